@@ -0,0 +1,369 @@
+"""
+Аналитика по всем пользователям: активные пользователи по дням,
+среднее потребление по городам, распределение тренировок.
+
+Запросы никогда не выполняются на рабочих таблицах: фоновая задача
+(или CLI) периодически снимает копию логов в колоночный снимок — по
+файлу .npy на колонку, — а отчёты считаются векторно (NumPy) по
+файлам, открытым через memory map.
+
+    python analytics.py snapshot
+    python analytics.py report [--days 30]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import date, datetime, timedelta
+from db import engines, fan_out
+from jobs import PeriodicJob
+from config import ANALYTICS_DIR, ANALYTICS_INTERVAL_HOURS, ANALYTICS_CHUNK_SIZE
+
+
+# День как целое число дней от 1970-01-01 (как datetime64[D])
+DAY_SQL = "CAST(julianday(date(timestamp)) - 2440587.5 AS INTEGER)"
+
+# Таблица снимка -> (таблица базы, [(колонка, SQL-выражение, тип)]).
+# Тип "category" — строка, хранится кодами int32 и списком значений в meta.json
+SNAPSHOT_TABLES = {
+    "users": ("users", [
+        ("user_id", "user_id", "int64"),
+        ("city", "COALESCE(lower(trim(city)), '')", "category"),
+    ]),
+    "water": ("water_logs", [
+        ("user_id", "user_id", "int64"),
+        ("day", DAY_SQL, "int32"),
+        ("amount", "COALESCE(amount, 0)", "float64"),
+    ]),
+    "food": ("food_logs", [
+        ("user_id", "user_id", "int64"),
+        ("day", DAY_SQL, "int32"),
+        ("calories", "COALESCE(calories, 0)", "float64"),
+    ]),
+    "workouts": ("workout_logs", [
+        ("user_id", "user_id", "int64"),
+        ("day", DAY_SQL, "int32"),
+        ("workout_type", "COALESCE(workout_type, '')", "category"),
+        ("duration", "COALESCE(duration, 0)", "int32"),
+        ("calories_burned", "COALESCE(calories_burned, 0)", "float64"),
+    ]),
+    # Дни, уже свёрнутые сжатием логов (без типов тренировок)
+    "daily": ("daily_log_totals", [
+        ("user_id", "user_id", "int64"),
+        ("day", "CAST(julianday(day) - 2440587.5 AS INTEGER)", "int32"),
+        ("water", "COALESCE(water, 0)", "float64"),
+        ("calories_in", "COALESCE(calories_in, 0)", "float64"),
+    ]),
+}
+
+LATEST_FILE = "LATEST"
+LOAD_ATTEMPTS = 3  # попыток открыть снимок, если его удалили во время открытия
+
+
+def _read_table(shard_engine, table: str, columns: list, chunk_size: int) -> dict:
+    import numpy as np
+
+    select_list = ", ".join(expression for _, expression, _ in columns)
+    chunks = {name: [] for name, _, _ in columns}
+    last_rowid = 0
+    with shard_engine.connect() as conn:
+        while True:
+            # Короткие выборки по rowid: читающая транзакция не держит
+            # блокировку базы и не мешает боту записывать логи
+            rows = conn.exec_driver_sql(
+                f"SELECT rowid, {select_list} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, chunk_size)
+            ).all()
+            conn.rollback()
+            if not rows:
+                break
+            values = list(zip(*rows))
+            for (name, _, dtype), column in zip(columns, values[1:]):
+                chunks[name].append(np.array(column, dtype=object if dtype == "category" else dtype))
+            last_rowid = rows[-1][0]
+    return chunks
+
+
+def _read_shard(shard_engine, chunk_size: int) -> dict:
+    return {
+        name: _read_table(shard_engine, table, columns, chunk_size)
+        for name, (table, columns) in SNAPSHOT_TABLES.items()
+    }
+
+
+def build_snapshot(directory: str = ANALYTICS_DIR, chunk_size: int = ANALYTICS_CHUNK_SIZE) -> str:
+    """
+    Копирует users и логи всех шардов в новый снимок <directory>/snapshot-<время>
+    и делает его текущим. Предыдущие снимки удаляются. Возвращает путь к снимку.
+    """
+    import numpy as np
+
+    created = datetime.utcnow()
+    shards = fan_out(_read_shard, chunk_size)
+
+    path = os.path.join(directory, f"snapshot-{created:%Y%m%dT%H%M%S}")
+    os.makedirs(path, exist_ok=True)
+    meta = {"created": created.isoformat(), "shards": len(engines), "rows": {}, "categories": {}}
+
+    for name, (_, columns) in SNAPSHOT_TABLES.items():
+        arrays = {}
+        for column, _, dtype in columns:
+            parts = [part for shard in shards for part in shard[name][column]]
+            if dtype == "category":
+                values = np.concatenate(parts) if parts else np.array([], dtype=object)
+                categories, codes = np.unique(values.astype(str), return_inverse=True)
+                arrays[column] = codes.astype(np.int32)
+                meta["categories"][f"{name}.{column}"] = categories.tolist()
+            else:
+                arrays[column] = np.concatenate(parts) if parts else np.array([], dtype=dtype)
+
+        if name == "users":
+            # Отсортированные user_id — для поиска города через searchsorted
+            order = np.argsort(arrays["user_id"], kind="stable")
+            arrays = {column: values[order] for column, values in arrays.items()}
+
+        for column, values in arrays.items():
+            np.save(os.path.join(path, f"{name}.{column}.npy"), values)
+        meta["rows"][name] = int(len(arrays["user_id"]))
+
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    # Переключение на новый снимок атомарно: читатели видят либо старый, либо новый
+    latest_tmp = os.path.join(directory, LATEST_FILE + ".tmp")
+    with open(latest_tmp, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(path))
+    os.replace(latest_tmp, os.path.join(directory, LATEST_FILE))
+
+    for entry in os.listdir(directory):
+        old = os.path.join(directory, entry)
+        if entry.startswith("snapshot-") and old != path and os.path.isdir(old):
+            # Уже открытые memory map старого снимка остаются валидными
+            shutil.rmtree(old, ignore_errors=True)
+    return path
+
+
+class Snapshot:
+    """Снимок, открытый только для чтения: колонки — массивы NumPy с memory map."""
+
+    def __init__(self, path: str):
+        import numpy as np
+
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.path = path
+        self.created = datetime.fromisoformat(meta["created"])
+        self.rows = meta["rows"]
+        self.categories = meta["categories"]
+        self.tables = {
+            name: {
+                column: np.load(os.path.join(path, f"{name}.{column}.npy"), mmap_mode="r")
+                for column, _, _ in columns
+            }
+            for name, (_, columns) in SNAPSHOT_TABLES.items()
+        }
+
+    @property
+    def today(self) -> int:
+        return (self.created.date() - date(1970, 1, 1)).days
+
+
+def load_snapshot(directory: str = ANALYTICS_DIR):
+    """Открывает текущий снимок или возвращает None, если снимков ещё нет."""
+    for attempt in range(LOAD_ATTEMPTS):
+        try:
+            with open(os.path.join(directory, LATEST_FILE), encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        try:
+            return Snapshot(os.path.join(directory, name))
+        except FileNotFoundError:
+            # Параллельный build_snapshot переключил LATEST и удалил этот
+            # снимок, пока он открывался, — читаем LATEST заново
+            if attempt == LOAD_ATTEMPTS - 1:
+                raise
+
+
+def _window(table: dict, start: int, end: int):
+    day = table["day"]
+    return (day >= start) & (day <= end)
+
+
+def _unique(values):
+    import numpy as np
+
+    # Сортировка и сравнение соседей: для int64 заметно быстрее np.unique
+    values = np.sort(values)
+    if len(values):
+        values = values[np.concatenate(([True], values[1:] != values[:-1]))]
+    return values
+
+
+def _active_keys(snapshot: Snapshot, start: int, end: int):
+    import numpy as np
+
+    # Пара (пользователь, день) в одном int64: дни окна занимают младшие 16 бит
+    keys = []
+    for name in ("water", "food", "workouts", "daily"):
+        table = snapshot.tables[name]
+        mask = _window(table, start, end)
+        keys.append(table["user_id"][mask].astype(np.int64) * 65536 + (table["day"][mask] - start))
+    return _unique(np.concatenate(keys))
+
+
+def _city_codes(snapshot: Snapshot, user_ids):
+    import numpy as np
+
+    users = snapshot.tables["users"]
+    if not len(users["user_id"]):
+        return np.full(len(user_ids), -1, dtype=np.int64)
+    user_index = np.minimum(np.searchsorted(users["user_id"], user_ids), len(users["user_id"]) - 1)
+    found = users["user_id"][user_index] == user_ids
+    return np.where(found, users["city"][user_index], -1)
+
+
+def active_users_per_day(snapshot: Snapshot, days: int = 30) -> list:
+    """[(дата, число пользователей хотя бы с одной записью)] за последние days дней снимка."""
+    import numpy as np
+
+    start = snapshot.today - days + 1
+    keys = _active_keys(snapshot, start, snapshot.today)
+    counts = np.bincount((keys % 65536).astype(np.int64), minlength=days)
+    first = date(1970, 1, 1) + timedelta(days=start)
+    return [(first + timedelta(days=i), int(count)) for i, count in enumerate(counts)]
+
+
+def intake_by_city(snapshot: Snapshot, days: int = 30, limit: int = 10) -> list:
+    """
+    [(город, активных пользователей, воды мл/день, ккал/день)] — средние
+    на активный день пользователя, города по убыванию числа пользователей.
+    """
+    import numpy as np
+
+    start, end = snapshot.today - days + 1, snapshot.today
+    cities = snapshot.categories["users.city"]
+    size = len(cities) + 1  # последний индекс — пользователи без профиля в снимке
+
+    def by_city(user_ids, weights=None):
+        codes = _city_codes(snapshot, np.asarray(user_ids, dtype=np.int64))
+        return np.bincount(np.where(codes < 0, size - 1, codes), weights=weights, minlength=size)
+
+    keys = _active_keys(snapshot, start, end)
+    active_users = keys // 65536
+    user_days = by_city(active_users)
+    users = by_city(_unique(active_users))
+
+    water = snapshot.tables["water"]
+    food = snapshot.tables["food"]
+    daily = snapshot.tables["daily"]
+    water_mask = _window(water, start, end)
+    food_mask = _window(food, start, end)
+    daily_mask = _window(daily, start, end)
+    water_total = (by_city(water["user_id"][water_mask], water["amount"][water_mask])
+                   + by_city(daily["user_id"][daily_mask], daily["water"][daily_mask]))
+    calories_total = (by_city(food["user_id"][food_mask], food["calories"][food_mask])
+                      + by_city(daily["user_id"][daily_mask], daily["calories_in"][daily_mask]))
+
+    labels = [city.title() or "не указан" for city in cities] + ["нет профиля"]
+    order = np.argsort(-users, kind="stable")
+    return [
+        (labels[i], int(users[i]), float(water_total[i] / user_days[i]), float(calories_total[i] / user_days[i]))
+        for i in order[:limit] if users[i]
+    ]
+
+
+def workout_distribution(snapshot: Snapshot, days: int = 30, limit: int = 10) -> list:
+    """
+    [(тип тренировки, число тренировок, минут, доля)] по убыванию числа:
+    limit самых частых типов (тип — свободный текст) и строка «другие»
+    с остальными. Дни, уже свёрнутые сжатием логов, типов не содержат
+    и не учитываются.
+    """
+    import numpy as np
+
+    workouts = snapshot.tables["workouts"]
+    mask = _window(workouts, snapshot.today - days + 1, snapshot.today)
+    types = snapshot.categories["workouts.workout_type"]
+    codes = workouts["workout_type"][mask]
+    counts = np.bincount(codes, minlength=len(types))
+    minutes = np.bincount(codes, weights=workouts["duration"][mask], minlength=len(types))
+    total = counts.sum()
+    order = np.argsort(-counts, kind="stable")
+    order = order[counts[order] > 0]
+    rows = [(types[i] or "без типа", int(counts[i]), int(minutes[i]), float(counts[i] / total))
+            for i in order[:limit]]
+    rest = order[limit:]
+    if len(rest):
+        other = int(counts[rest].sum())
+        rows.append(("другие", other, int(minutes[rest].sum()), float(other / total)))
+    return rows
+
+
+def build_report(snapshot: Snapshot, days: int = 30) -> str:
+    active = active_users_per_day(snapshot, days)
+    lines = [
+        f"Снимок от {snapshot.created:%Y-%m-%d %H:%M} UTC, период {days} дн.",
+        "",
+        "Активные пользователи по дням:",
+    ]
+    lines += [f"  {day:%Y-%m-%d}: {count}" for day, count in active[-14:]]
+    if len(active) > 14:
+        average = sum(count for _, count in active) / len(active)
+        lines.append(f"  в среднем за период: {average:.1f}")
+
+    lines += ["", "Среднее потребление по городам (на активный день):"]
+    cities = intake_by_city(snapshot, days)
+    lines += [f"  {city}: {users} польз., {water:.0f} мл воды, {calories:.0f} ккал"
+              for city, users, water, calories in cities] or ["  нет данных"]
+
+    lines += ["", "Тренировки:"]
+    workouts = workout_distribution(snapshot, days)
+    lines += [f"  {workout_type}: {count} ({share:.0%}), {minutes} мин"
+              for workout_type, count, minutes, share in workouts] or ["  нет данных"]
+    return "\n".join(lines)
+
+
+class AnalyticsJob(PeriodicJob):
+    """Фоновое обновление снимка раз в interval часов."""
+
+    error_message = "Ошибка построения снимка аналитики"
+
+    def __init__(self, interval_hours: float = ANALYTICS_INTERVAL_HOURS, directory: str = ANALYTICS_DIR):
+        super().__init__(interval_hours * 3600)
+        self.directory = directory
+
+    def run(self):
+        build_snapshot(self.directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Аналитика по колоночному снимку логов.")
+    parser.add_argument("--dir", default=ANALYTICS_DIR, help="каталог снимков")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    snapshot_parser = subparsers.add_parser("snapshot", help="построить новый снимок")
+    snapshot_parser.add_argument("--chunk-size", type=int, default=ANALYTICS_CHUNK_SIZE)
+    report_parser = subparsers.add_parser("report", help="показать отчёт по текущему снимку")
+    report_parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    if args.command == "snapshot":
+        started = time.perf_counter()
+        path = build_snapshot(args.dir, args.chunk_size)
+        print(f"Снимок {path} — {time.perf_counter() - started:.1f} с")
+        return 0
+
+    snapshot = load_snapshot(args.dir)
+    if snapshot is None:
+        print("Снимков ещё нет: сначала выполните python analytics.py snapshot")
+        return 1
+    started = time.perf_counter()
+    print(build_report(snapshot, args.days))
+    print(f"\nОтчёт посчитан за {(time.perf_counter() - started) * 1000:.0f} мс")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Микробенчмарк построения графиков для /plot_progress: прежний вариант
+через plotly.graph_objects/make_subplots против словарей из charts.py.
+Измеряется только построение фигур, без рендера в PNG/HTML.
+
+    python bench_charts.py [--days 30] [--repeat 200]
+"""
+import argparse
+import json
+import timeit
+from datetime import date, timedelta
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from charts import water_figure, calorie_figure, combined_figure
+
+
+def build_with_graph_objects(days, water_values, net_calories, water_goal, calorie_goal):
+    # Построение фигур в том виде, в котором оно было в cmd_progress_full
+    water_fig = go.Figure()
+    water_fig.add_trace(go.Scatter(x=days, y=water_values, mode="lines+markers", name="Выпито воды (мл)"))
+    water_fig.add_trace(go.Scatter(x=days, y=[water_goal] * len(days), mode="lines", name="Норма воды (мл)",
+                                   line=dict(dash='dash')))
+    water_fig.update_layout(title="Прогресс по воде", xaxis_title="Дата", yaxis_title="Вода (мл)",
+                            template="plotly_white")
+
+    calorie_fig = go.Figure()
+    calorie_fig.add_trace(go.Scatter(x=days, y=net_calories, mode="lines+markers", name="Баланс калорий (ккал)"))
+    calorie_fig.add_trace(go.Scatter(x=days, y=[calorie_goal] * len(days), mode="lines",
+                                     name="Целевая норма калорий (ккал)", line=dict(dash='dash')))
+    calorie_fig.update_layout(title="Прогресс по калориям", xaxis_title="Дата", yaxis_title="Калории (ккал)",
+                              template="plotly_white")
+
+    html_fig = make_subplots(rows=2, cols=1, subplot_titles=("Прогресс по воде", "Прогресс по калориям"),
+                             vertical_spacing=0.4)
+    html_fig.add_trace(go.Scatter(x=days, y=water_values, mode="lines+markers", name="Выпито воды (мл)"),
+                       row=1, col=1)
+    html_fig.add_trace(go.Scatter(x=days, y=[water_goal] * len(days), mode="lines", name="Норма воды (мл)",
+                                  line=dict(dash='dash')), row=1, col=1)
+    html_fig.add_trace(go.Scatter(x=days, y=net_calories, mode="lines+markers", name="Баланс калорий (ккал)"),
+                       row=2, col=1)
+    html_fig.add_trace(go.Scatter(x=days, y=[calorie_goal] * len(days), mode="lines",
+                                  name="Целевая норма калорий (ккал)", line=dict(dash='dash')), row=2, col=1)
+    html_fig.update_layout(title="Интерактивный график прогресса", template="plotly_white", height=700)
+    html_fig.update_xaxes(title_text="Дата", row=1, col=1)
+    html_fig.update_yaxes(title_text="Вода (мл)", row=1, col=1)
+    html_fig.update_xaxes(title_text="Дата", row=2, col=1)
+    html_fig.update_yaxes(title_text="Калории (ккал)", row=2, col=1)
+    return water_fig, calorie_fig, html_fig
+
+
+def build_with_dicts(days, water_values, net_calories, water_goal, calorie_goal):
+    return (
+        water_figure(days, water_values, water_goal),
+        calorie_figure(days, net_calories, calorie_goal),
+        combined_figure(days, water_values, net_calories, water_goal, calorie_goal),
+    )
+
+
+def _normalized(figure) -> dict:
+    if not isinstance(figure, dict):
+        figure = figure.to_plotly_json()
+    return json.loads(json.dumps(figure, sort_keys=True))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    start = date(2025, 1, 1)
+    days = [(start + timedelta(days=i)).isoformat() for i in range(args.days)]
+    water_values = [1500.0 + i for i in range(args.days)]
+    net_calories = [2000.0 - i for i in range(args.days)]
+    data = (days, water_values, net_calories, 2500.0, 2200.0)
+
+    # Словари должны описывать те же фигуры, что и graph_objects
+    for old, new in zip(build_with_graph_objects(*data), build_with_dicts(*data)):
+        assert _normalized(old) == _normalized(new), "спецификации графиков расходятся"
+
+    results = {}
+    for name, build in (("graph_objects", build_with_graph_objects), ("dicts", build_with_dicts)):
+        seconds = min(timeit.repeat(lambda: build(*data), number=args.repeat, repeat=3)) / args.repeat
+        results[name] = seconds
+        print(f"{name:>14}: {seconds * 1000:.3f} мс на три графика")
+    print(f"{'ускорение':>14}: x{results['graph_objects'] / results['dicts']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
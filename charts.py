@@ -0,0 +1,111 @@
+from functools import lru_cache
+
+
+# Графики собираются как обычные словари в формате plotly.js: так не
+# тратится время на валидацию graph_objects, а в шаблон подставляются
+# только массивы данных. PNG и HTML строятся из одних и тех же словарей.
+# Сам plotly импортируется только при первом рендере (или в preload_plotting).
+
+WATER_TITLE = "Прогресс по воде"
+CALORIE_TITLE = "Прогресс по калориям"
+
+
+@lru_cache(maxsize=None)
+def _template() -> dict:
+    # Разворачиваем именованный шаблон один раз: с validate=False plotly его не подставляет
+    import plotly.io as pio
+    return pio.templates["plotly_white"].to_plotly_json()
+
+
+def preload_plotting():
+    """
+    Заранее загружает plotly и запускает процесс kaleido пустым рендером,
+    чтобы первый /plot_progress не ждал импорта и старта рендерера.
+    """
+    render_png(water_figure([], [], 0))
+
+
+def _line_traces(days, values, goal, values_name: str, goal_name: str, axes: dict = None):
+    axes = axes or {}
+    return [
+        {"type": "scatter", "x": days, "y": values, "mode": "lines+markers", "name": values_name, **axes},
+        {"type": "scatter", "x": days, "y": [goal] * len(days), "mode": "lines", "name": goal_name,
+         "line": {"dash": "dash"}, **axes},
+    ]
+
+
+def water_figure(days, water_values, water_goal) -> dict:
+    return {
+        "data": _line_traces(days, water_values, water_goal, "Выпито воды (мл)", "Норма воды (мл)"),
+        "layout": {
+            "template": _template(),
+            "title": {"text": WATER_TITLE},
+            "xaxis": {"title": {"text": "Дата"}},
+            "yaxis": {"title": {"text": "Вода (мл)"}},
+        },
+    }
+
+
+def calorie_figure(days, net_calories, calorie_goal) -> dict:
+    return {
+        "data": _line_traces(days, net_calories, calorie_goal,
+                             "Баланс калорий (ккал)", "Целевая норма калорий (ккал)"),
+        "layout": {
+            "template": _template(),
+            "title": {"text": CALORIE_TITLE},
+            "xaxis": {"title": {"text": "Дата"}},
+            "yaxis": {"title": {"text": "Калории (ккал)"}},
+        },
+    }
+
+
+def combined_figure(days, water_values, net_calories, water_goal, calorie_goal) -> dict:
+    """
+    Два подграфика друг под другом — то же, что make_subplots(rows=2, cols=1,
+    vertical_spacing=0.4): у каждого по 30% высоты, подписи сверху.
+    """
+    subplot_title = {"font": {"size": 16}, "showarrow": False, "x": 0.5, "xanchor": "center",
+                     "xref": "paper", "yanchor": "bottom", "yref": "paper"}
+    return {
+        "data": (
+            _line_traces(days, water_values, water_goal, "Выпито воды (мл)", "Норма воды (мл)",
+                         {"xaxis": "x", "yaxis": "y"})
+            + _line_traces(days, net_calories, calorie_goal, "Баланс калорий (ккал)",
+                           "Целевая норма калорий (ккал)", {"xaxis": "x2", "yaxis": "y2"})
+        ),
+        "layout": {
+            "template": _template(),
+            "title": {"text": "Интерактивный график прогресса"},
+            "height": 700,
+            "xaxis": {"anchor": "y", "domain": [0.0, 1.0], "title": {"text": "Дата"}},
+            "yaxis": {"anchor": "x", "domain": [0.7, 1.0], "title": {"text": "Вода (мл)"}},
+            "xaxis2": {"anchor": "y2", "domain": [0.0, 1.0], "title": {"text": "Дата"}},
+            "yaxis2": {"anchor": "x2", "domain": [0.0, 0.3], "title": {"text": "Калории (ккал)"}},
+            "annotations": [
+                {**subplot_title, "text": WATER_TITLE, "y": 1.0},
+                {**subplot_title, "text": CALORIE_TITLE, "y": 0.3},
+            ],
+        },
+    }
+
+
+def render_png(figure: dict) -> bytes:
+    import plotly.io as pio
+    return pio.to_image(figure, format="png", validate=False)
+
+
+def render_html(figure: dict) -> str:
+    import plotly.io as pio
+    return pio.to_html(figure, full_html=True, validate=False)
+
+
+def render_progress(days, water_values, net_calories, water_goal, calorie_goal):
+    """
+    Строит и рендерит все графики /plot_progress: PNG по воде, PNG по
+    калориям и объединённый HTML. Блокирующая функция (kaleido, первый
+    импорт plotly) — вызывается из отдельного потока.
+    """
+    water_png = render_png(water_figure(days, water_values, water_goal))
+    calorie_png = render_png(calorie_figure(days, net_calories, calorie_goal))
+    html_str = render_html(combined_figure(days, water_values, net_calories, water_goal, calorie_goal))
+    return water_png, calorie_png, html_str
@@ -0,0 +1,258 @@
+import argparse
+import csv
+import gzip
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from db import fan_out
+from jobs import PeriodicJob
+from models import DailyLogTotal, WaterLog, FoodLog, WorkoutLog
+from config import (
+    LOG_RETENTION_DAYS, COMPACTION_INTERVAL_HOURS, COMPACTION_BATCH_SIZE,
+    COMPACTION_ARCHIVE_DIR, COMPACTION_VACUUM_PAGES
+)
+
+
+# Таблица логов -> (модель, колонка дневных сумм, что в неё суммируется)
+COMPACTED_TABLES = {
+    "water_logs": (WaterLog, "water", "amount"),
+    "food_logs": (FoodLog, "calories_in", "calories"),
+    "workout_logs": (WorkoutLog, "calories_out", "calories_burned"),
+}
+
+TOTAL_COLUMNS = ("water", "calories_in", "calories_out")
+
+# Повторное сжатие того же дня (например, после импорта старых записей)
+# прибавляет суммы к уже сохранённым
+UPSERT_TOTALS_SQL = (
+    f"INSERT INTO {DailyLogTotal.__tablename__} (user_id, day, {', '.join(TOTAL_COLUMNS)}) "
+    f"VALUES (?, ?, ?, ?, ?) "
+    f"ON CONFLICT (user_id, day) DO UPDATE SET "
+    + ", ".join(f"{column} = {column} + excluded.{column}" for column in TOTAL_COLUMNS)
+)
+
+
+def daily_totals(session: Session, user_id: int):
+    """
+    Дневные суммы пользователя по всей истории: воды, полученных и
+    сожжённых калорий — три словаря {дата: сумма}. Складывает строки
+    логов и уже сжатые дни из daily_log_totals, поэтому результат не
+    зависит от того, прошло ли сжатие.
+    """
+    totals = {column: {} for column in TOTAL_COLUMNS}
+    for model, column, source in COMPACTED_TABLES.values():
+        day = func.date(model.timestamp)
+        rows = (
+            session.query(day, func.sum(getattr(model, source)))
+            .filter(model.user_id == user_id)
+            .group_by(day)
+            .all()
+        )
+        for d, total in rows:
+            totals[column][date.fromisoformat(d)] = total or 0.0
+
+    compacted = session.query(DailyLogTotal).filter(DailyLogTotal.user_id == user_id).all()
+    for row in compacted:
+        for column in TOTAL_COLUMNS:
+            values = totals[column]
+            values[row.day] = values.get(row.day, 0.0) + (getattr(row, column) or 0.0)
+    return totals["water"], totals["calories_in"], totals["calories_out"]
+
+
+def _archive_path(archive_dir: str, shard_engine, table: str, started: datetime) -> str:
+    # Имя базы в имени файла, чтобы архивы разных шардов не смешивались
+    database = os.path.splitext(os.path.basename(shard_engine.url.database or "db"))[0]
+    return os.path.join(archive_dir, f"{database}-{table}-{started:%Y%m%dT%H%M%S}.csv.gz")
+
+
+def _compact_table(conn, table: str, column: str, source: str, cutoff: str, batch_size: int,
+                   archive_path: str = None) -> int:
+    target = TOTAL_COLUMNS.index(column)
+    archive = writer = None
+    compacted = 0
+    last_id = 0
+
+    try:
+        while True:
+            # Пачка — диапазон id: без длинных списков параметров и без нового индекса
+            # по timestamp, за весь проход таблица читается по первичному ключу один раз
+            ids = [row[0] for row in conn.exec_driver_sql(
+                f"SELECT id FROM {table} WHERE id > ? AND timestamp < ? ORDER BY id LIMIT ?",
+                (last_id, cutoff, batch_size)
+            )]
+            if not ids:
+                break
+            batch = (ids[0], ids[-1], cutoff)
+            where = "id BETWEEN ? AND ? AND timestamp < ?"
+
+            params = []
+            for user_id, day, total in conn.exec_driver_sql(
+                f"SELECT user_id, date(timestamp), SUM({source}) FROM {table} WHERE {where} "
+                f"GROUP BY user_id, date(timestamp)",
+                batch
+            ):
+                values = [0.0] * len(TOTAL_COLUMNS)
+                values[target] = total or 0.0
+                params.append((user_id, day, *values))
+            conn.exec_driver_sql(UPSERT_TOTALS_SQL, params)
+
+            if archive_path:
+                result = conn.exec_driver_sql(f"SELECT * FROM {table} WHERE {where} ORDER BY id", batch)
+                if archive is None:
+                    os.makedirs(os.path.dirname(archive_path) or ".", exist_ok=True)
+                    archive = gzip.open(archive_path, "wt", encoding="utf-8", newline="")
+                    writer = csv.writer(archive)
+                    writer.writerow(result.keys())
+                writer.writerows(result)
+                # Архив дописывается до фиксации удаления: при сбое строки могут
+                # попасть в архив дважды, но не потеряются
+                archive.flush()
+
+            conn.exec_driver_sql(f"DELETE FROM {table} WHERE {where}", batch)
+            # Каждая пачка — своя короткая транзакция, бот успевает писать между ними
+            conn.commit()
+            compacted += len(ids)
+            last_id = ids[-1]
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return compacted
+
+
+def incremental_vacuum(conn, pages: int = COMPACTION_VACUUM_PAGES):
+    """
+    Возвращает системе свободные страницы базы шагами по pages страниц,
+    чтобы не держать блокировку записи долго. Возвращает число
+    освобождённых страниц или None, если в базе не включён режим
+    auto_vacuum = INCREMENTAL.
+    """
+    if conn.dialect.name != "sqlite":
+        return None
+    if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+        return None
+
+    free_before = free_pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    while free_pages:
+        conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(pages)})")
+        conn.commit()
+        remaining = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        if remaining >= free_pages:
+            break
+        free_pages = remaining
+    return free_before - free_pages
+
+
+def _compact_shard(shard_engine, started: datetime, cutoff: str, batch_size: int,
+                   archive_dir: str, vacuum: bool) -> dict:
+    stats = {}
+    with shard_engine.connect() as conn:
+        for table, (_, column, source) in COMPACTED_TABLES.items():
+            archive_path = _archive_path(archive_dir, shard_engine, table, started) if archive_dir else None
+            stats[table] = _compact_table(conn, table, column, source, cutoff, batch_size, archive_path)
+        stats["vacuum_pages"] = incremental_vacuum(conn) if vacuum else None
+    return stats
+
+
+def compact_logs(retention_days: int = LOG_RETENTION_DAYS, batch_size: int = COMPACTION_BATCH_SIZE,
+                 archive_dir: str = COMPACTION_ARCHIVE_DIR, vacuum: bool = True) -> dict:
+    """
+    Сворачивает строки логов старше retention_days полных дней в дневные
+    суммы daily_log_totals и удаляет их пачками по batch_size строк.
+    Если задан archive_dir, удаляемые строки сохраняются туда в
+    <база>-<таблица>-<время>.csv.gz. В конце освобождает место
+    incremental_vacuum. Шарды обрабатываются параллельно.
+    Возвращает число сжатых строк по таблицам и освобождённых страниц.
+    """
+    if retention_days < 1:
+        raise ValueError("Горизонт хранения должен быть не меньше одного дня")
+
+    started = datetime.utcnow()
+    # Граница — начало дня: сегодняшние суммы (тренды, напоминания) всегда считаются по логам
+    cutoff_day = started.date() - timedelta(days=retention_days)
+    cutoff = datetime.combine(cutoff_day, datetime.min.time()).isoformat(" ", "microseconds")
+
+    stats = {table: 0 for table in COMPACTED_TABLES}
+    stats["vacuum_pages"] = None
+    for shard_stats in fan_out(_compact_shard, started, cutoff, batch_size, archive_dir, vacuum):
+        for table in COMPACTED_TABLES:
+            stats[table] += shard_stats[table]
+        if shard_stats["vacuum_pages"] is not None:
+            stats["vacuum_pages"] = (stats["vacuum_pages"] or 0) + shard_stats["vacuum_pages"]
+    return stats
+
+
+def _enable_incremental_vacuum(shard_engine):
+    with shard_engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+
+
+def enable_incremental_vacuum():
+    """
+    Переводит существующие базы SQLite (все шарды) в режим
+    auto_vacuum = INCREMENTAL. Требует полного VACUUM: база блокируется
+    на всё время перестройки, поэтому запускать при остановленном боте.
+    """
+    fan_out(_enable_incremental_vacuum)
+
+
+class CompactionJob(PeriodicJob):
+    """Фоновое сжатие логов раз в interval часов; выключено, пока не задан горизонт хранения."""
+
+    error_message = "Ошибка сжатия логов"
+
+    def __init__(self, retention_days: int = LOG_RETENTION_DAYS,
+                 interval_hours: float = COMPACTION_INTERVAL_HOURS):
+        super().__init__(interval_hours * 3600)
+        self.retention_days = retention_days
+        self.last_stats = None
+
+    def enabled(self) -> bool:
+        return self.retention_days > 0 and super().enabled()
+
+    def run(self):
+        self.last_stats = compact_logs(self.retention_days)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сжатие старых логов в дневные суммы.")
+    parser.add_argument("--retention-days", type=int, default=LOG_RETENTION_DAYS,
+                        help="сколько последних дней хранить логи построчно (по умолчанию LOG_RETENTION_DAYS)")
+    parser.add_argument("--batch-size", type=int, default=COMPACTION_BATCH_SIZE)
+    parser.add_argument("--archive-dir", default=COMPACTION_ARCHIVE_DIR,
+                        help="сохранять удаляемые строки в сжатые CSV в этом каталоге")
+    parser.add_argument("--no-vacuum", action="store_true", help="не освобождать место в файле базы")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="однократно перевести существующую базу в режим incremental vacuum (полный VACUUM)")
+    args = parser.parse_args(argv)
+
+    if args.enable_incremental_vacuum:
+        started = time.perf_counter()
+        enable_incremental_vacuum()
+        print(f"Режим incremental vacuum включён — {time.perf_counter() - started:.1f} с")
+
+    if args.retention_days < 1:
+        if args.enable_incremental_vacuum:
+            return 0
+        print("Сжатие выключено: задайте --retention-days или LOG_RETENTION_DAYS.")
+        return 1
+
+    started = time.perf_counter()
+    stats = compact_logs(args.retention_days, args.batch_size, args.archive_dir, vacuum=not args.no_vacuum)
+    vacuum = stats.pop("vacuum_pages")
+    print(", ".join(f"{table}: {count}" for table, count in stats.items())
+          + f" строк сжато — {time.perf_counter() - started:.1f} с")
+    if vacuum is None and not args.no_vacuum:
+        print("Incremental vacuum недоступен: запустите с --enable-incremental-vacuum при остановленном боте.")
+    elif vacuum is not None:
+        print(f"Освобождено страниц: {vacuum}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
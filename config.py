@@ -5,5 +5,54 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///users.db")
+# Число шардов; при значении больше 1 в DATABASE_URL нужен {shard}: sqlite:///data/users-{shard}.db
+DATABASE_SHARDS = int(os.getenv("DATABASE_SHARDS", "1"))
 OPENWEATHERMAP_API_KEY = os.getenv("OPENWEATHERMAP_API_KEY")
 OPENFOODFACTS_API_URL = "https://world.openfoodfacts.org/api/v0/product/"
+
+# Ограничение частоты запросов и очередь тяжёлых команд
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "20"))  # единиц стоимости в минуту
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+EXPENSIVE_WORKERS = int(os.getenv("EXPENSIVE_WORKERS", "2"))
+EXPENSIVE_QUEUE_SIZE = int(os.getenv("EXPENSIVE_QUEUE_SIZE", "20"))
+EXPENSIVE_MAX_WAIT = float(os.getenv("EXPENSIVE_MAX_WAIT", "30"))  # секунд
+CHEAP_LATENCY_SLO = float(os.getenv("CHEAP_LATENCY_SLO", "1.0"))  # секунд
+
+# Исходящие сообщения: лимиты Telegram (~30 сообщений/с всего и ~1/с в один чат)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))  # сообщений в секунду
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "10000"))
+
+# Напоминания о воде (часы в UTC)
+REMINDER_INTERVAL_MINUTES = int(os.getenv("REMINDER_INTERVAL_MINUTES", "120"))
+REMINDER_START_HOUR = int(os.getenv("REMINDER_START_HOUR", "6"))
+REMINDER_END_HOUR = int(os.getenv("REMINDER_END_HOUR", "20"))
+REMINDER_MIN_DEFICIT = float(os.getenv("REMINDER_MIN_DEFICIT", "250"))  # мл
+REMINDER_TICK_SECONDS = float(os.getenv("REMINDER_TICK_SECONDS", "30"))
+
+# Загрузить plotly в фоне сразу после старта, а не при первом /plot_progress
+PRELOAD_PLOTTING = os.getenv("PRELOAD_PLOTTING", "0") == "1"
+
+# Администраторы бота (id через запятую) — для служебных команд
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Выборочное профилирование обработчиков
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))  # доля профилируемых апдейтов
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.005"))  # период снятия стека, с
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+
+# Сжатие старых логов в дневные суммы. Исходные строки удаляются безвозвратно
+# (кроме архива), поэтому по умолчанию выключено: 0 — хранить логи бессрочно
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "0"))
+COMPACTION_INTERVAL_HOURS = float(os.getenv("COMPACTION_INTERVAL_HOURS", "24"))
+COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", "5000"))  # строк в одной транзакции
+COMPACTION_ARCHIVE_DIR = os.getenv("COMPACTION_ARCHIVE_DIR", "")  # пусто — не архивировать удаляемые строки
+COMPACTION_VACUUM_PAGES = int(os.getenv("COMPACTION_VACUUM_PAGES", "2000"))  # страниц за шаг incremental_vacuum
+
+# Аналитика по колоночному снимку логов (0 — снимок только вручную)
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+ANALYTICS_INTERVAL_HOURS = float(os.getenv("ANALYTICS_INTERVAL_HOURS", "6"))
+ANALYTICS_CHUNK_SIZE = int(os.getenv("ANALYTICS_CHUNK_SIZE", "50000"))  # строк за одну выборку из базы
@@ -1,12 +1,170 @@
-from sqlalchemy import create_engine
+import asyncio
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import sessionmaker
-from models import Base
-from config import DATABASE_URL
+from models import Base, User
+from config import DATABASE_URL, DATABASE_SHARDS
 
 
-engine = create_engine(DATABASE_URL, echo=True, future=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SHARD_PLACEHOLDER = "{shard}"
+
+
+def shard_urls(url: str = DATABASE_URL, shards: int = DATABASE_SHARDS) -> list:
+    """
+    Адреса баз шардов. При shards > 1 в адресе должен быть {shard},
+    например sqlite:///data/users-{shard}.db -> users-0.db, users-1.db, ...
+    """
+    if shards <= 1:
+        return [url]
+    if SHARD_PLACEHOLDER not in url:
+        raise ValueError(f"DATABASE_URL должен содержать {SHARD_PLACEHOLDER}, если DATABASE_SHARDS > 1")
+    return [url.replace(SHARD_PLACEHOLDER, str(shard)) for shard in range(shards)]
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # Действует только для новой базы (до создания первой таблицы): тогда
+    # место от удалённых логов можно возвращать через incremental_vacuum.
+    # Существующую базу переводит python compaction.py --enable-incremental-vacuum
+    dbapi_connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+def _create_engine(url: str):
+    shard_engine = create_engine(url, echo=True, future=True)
+    if shard_engine.dialect.name == "sqlite":
+        event.listen(shard_engine, "connect", _set_sqlite_pragmas)
+    return shard_engine
+
+
+# Каждый шард — отдельная база со своей блокировкой записи, поэтому записи
+# разных пользователей не ждут друг друга. Без шардирования шард один.
+engines = [_create_engine(url) for url in shard_urls()]
+session_factories = [sessionmaker(autocommit=False, autoflush=False, bind=e) for e in engines]
+# Очередь операций обработчиков к каждому шарду (см. run_in_shard)
+shard_locks = [asyncio.Lock() for _ in engines]
+
+
+def shard_for(user_id: int) -> int:
+    # Стабильный хеш (в отличие от hash() не зависит от процесса) разносит
+    # подряд идущие id по разным шардам
+    return zlib.crc32(int(user_id).to_bytes(8, "little", signed=True)) % len(engines)
+
+
+def engine_for(user_id: int):
+    return engines[shard_for(user_id)]
+
+
+def session_for(user_id: int):
+    """Сессия базы шарда, в котором хранятся данные пользователя."""
+    return session_factories[shard_for(user_id)]()
+
+
+def _run_with_session(shard: int, fn, *args, **kwargs):
+    # Объекты, загруженные в fn, остаются читаемыми после закрытия сессии
+    with session_factories[shard](expire_on_commit=False) as session:
+        return fn(session, *args, **kwargs)
+
+
+async def run_in_shard(user_id: int, fn, *args, **kwargs):
+    """
+    Выполняет fn(session, *args, **kwargs) с сессией шарда пользователя в
+    отдельном потоке, не блокируя event loop, и возвращает результат.
+    Операции одного шарда идут по очереди (SQLite всё равно допускает
+    одного писателя), операции разных шардов — параллельно.
+    """
+    shard = shard_for(user_id)
+    async with shard_locks[shard]:
+        return await asyncio.to_thread(_run_with_session, shard, fn, *args, **kwargs)
+
+
+def group_by_shard(user_ids) -> dict:
+    """Раскладывает user_id по шардам: {номер шарда: [user_id, ...]}."""
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(shard_for(user_id), []).append(user_id)
+    return groups
+
+
+def fan_out(fn, *args, **kwargs) -> list:
+    """
+    Выполняет fn(engine шарда, *args, **kwargs) на всех шардах параллельно
+    (по потоку на шард) и возвращает список результатов в порядке шардов.
+    Для служебных и агрегирующих запросов по всем пользователям.
+    """
+    if len(engines) == 1:
+        return [fn(engines[0], *args, **kwargs)]
+    with ThreadPoolExecutor(max_workers=len(engines), thread_name_prefix="shard") as pool:
+        return list(pool.map(lambda shard_engine: fn(shard_engine, *args, **kwargs), engines))
+
+
+BACKFILL_CHUNK_SIZE = 50000  # пользователей в одной выборке при заполнении новых колонок
+
+
+def _backfill_calorie_goal_custom(conn):
+    # Норма считается введённой вручную, если не совпадает с расчётной.
+    # Сравнивать можно только сейчас, пока формула та же, что при настройке
+    # профиля: после её изменения все нормы по умолчанию тоже разойдутся с ней
+    import numpy as np
+    from utils import calculate_calorie_goal_batch
+
+    last_user_id = None
+    while True:
+        query = (
+            "SELECT user_id, weight, height, age, activity, sex, calorie_goal FROM users "
+            "WHERE calorie_goal IS NOT NULL AND weight IS NOT NULL AND height IS NOT NULL "
+            "AND age IS NOT NULL AND activity IS NOT NULL"
+        )
+        params = ()
+        if last_user_id is not None:
+            query += " AND user_id > ?"
+            params = (last_user_id,)
+        rows = conn.exec_driver_sql(query + " ORDER BY user_id LIMIT ?", params + (BACKFILL_CHUNK_SIZE,)).all()
+        if not rows:
+            break
+        user_ids, weight, height, age, activity, sex, calorie_goal = zip(*rows)
+        default_goals = calculate_calorie_goal_batch(weight, height, age, activity, [s or '' for s in sex])
+        custom = np.abs(np.array(calorie_goal, dtype=float) - default_goals) > 0.5
+        conn.exec_driver_sql(
+            "UPDATE users SET calorie_goal_custom = ? WHERE user_id = ?",
+            list(zip(custom.astype(int).tolist(), user_ids))
+        )
+        last_user_id = user_ids[-1]
+    conn.exec_driver_sql("UPDATE users SET calorie_goal_custom = 0 WHERE calorie_goal_custom IS NULL")
+
+
+# Заполнение новой колонки для уже существующих строк: (таблица, колонка) -> функция(conn)
+COLUMN_BACKFILLS = {
+    (User.__tablename__, "calorie_goal_custom"): _backfill_calorie_goal_custom,
+}
+
+
+def _add_missing_columns(shard_engine):
+    # create_all не добавляет новые колонки в уже существующие таблицы.
+    # Новые колонки моделей должны допускать NULL
+    inspector = inspect(shard_engine)
+    with shard_engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                        f"{column.type.compile(shard_engine.dialect)}"
+                    )
+                    backfill = COLUMN_BACKFILLS.get((table.name, column.name))
+                    if backfill is not None:
+                        backfill(conn)
+
+
+def _init_shard(shard_engine):
+    Base.metadata.create_all(bind=shard_engine)
+    _add_missing_columns(shard_engine)
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=shard_engine, checkfirst=True)
 
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    """Создаёт недостающие таблицы и индексы во всех шардах."""
+    fan_out(_init_shard)
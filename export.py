@@ -0,0 +1,144 @@
+import csv
+import importlib.util
+import io
+import tempfile
+import zipfile
+from functools import lru_cache
+from sqlalchemy import select
+from aiogram.types import InputFile
+from db import session_for
+from models import WaterLog, FoodLog, WorkoutLog, DailyLogTotal
+
+
+EXPORT_CHUNK_SIZE = 1000  # строк за одну выборку с сервера
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024  # до 8 МБ держим в памяти, дальше — на диске
+
+# Таблица в архиве -> (модель, выгружаемые колонки)
+EXPORT_TABLES = {
+    "water_logs": (WaterLog, ["timestamp", "amount"]),
+    "food_logs": (FoodLog, ["timestamp", "product_name", "amount", "calories"]),
+    "workout_logs": (WorkoutLog, ["timestamp", "workout_type", "duration", "calories_burned", "water_consumed"]),
+    # Дни старше горизонта хранения, уже свёрнутые в суммы (см. compaction.py)
+    "daily_log_totals": (DailyLogTotal, ["day", "water", "calories_in", "calories_out"]),
+}
+
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+@lru_cache(maxsize=None)
+def parquet_available() -> bool:
+    # pyarrow не обязателен (без него доступен только CSV) и тяжёлый,
+    # поэтому импортируется только при самом экспорте в Parquet
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def iter_log_chunks(session, model, columns, user_id: int, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Построчно читает логи пользователя серверным курсором (yield_per)
+    и отдаёт их пачками по chunk_size строк. В памяти одновременно
+    находится не больше одной пачки.
+    """
+    stmt = (
+        select(*[getattr(model, name) for name in columns])
+        .where(model.user_id == user_id)
+        .order_by(*model.__table__.primary_key.columns)
+        .execution_options(yield_per=chunk_size)
+    )
+    result = session.execute(stmt)
+    for partition in result.partitions():
+        yield partition
+
+
+def _write_csv(zf: zipfile.ZipFile, name: str, model, columns, chunks) -> int:
+    rows_written = 0
+    with zf.open(f"{name}.csv", "w") as raw:
+        text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(
+                [value.isoformat() if hasattr(value, "isoformat") else value for value in row]
+                for row in chunk
+            )
+            rows_written += len(chunk)
+        text.flush()
+        text.detach()
+    return rows_written
+
+
+def _arrow_schema(model, columns):
+    import pyarrow as pa
+    # Типы колонок берём из модели, чтобы пустые и неполные выгрузки имели ту же схему
+    arrow_types = {
+        "DATETIME": pa.timestamp("us"),
+        "DATE": pa.date32(),
+        "FLOAT": pa.float64(),
+        "INTEGER": pa.int64(),
+    }
+    return pa.schema([
+        (name, arrow_types.get(model.__table__.c[name].type.__visit_name__.upper(), pa.string()))
+        for name in columns
+    ])
+
+
+def _write_parquet(zf: zipfile.ZipFile, name: str, model, columns, chunks) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _arrow_schema(model, columns)
+    rows_written = 0
+    with zf.open(f"{name}.parquet", "w") as raw:
+        with pq.ParquetWriter(raw, schema) as writer:
+            for chunk in chunks:
+                # Каждая пачка становится отдельной row group
+                table = pa.Table.from_pylist([dict(zip(columns, row)) for row in chunk], schema=schema)
+                writer.write_table(table)
+                rows_written += len(chunk)
+    return rows_written
+
+
+def build_export(user_id: int, fmt: str = "csv", chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Собирает zip-архив со всеми логами пользователя (вода, еда, тренировки)
+    во временный файл. Возвращает (файл, число строк); файл открыт и
+    спозиционирован в начало, закрывать его должен вызывающий код.
+    Данные читаются и кодируются пачками, поэтому расход памяти не зависит
+    от длины истории.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+    if fmt == "parquet" and not parquet_available():
+        raise ValueError("Экспорт в Parquet недоступен: не установлен pyarrow")
+
+    write_table = _write_parquet if fmt == "parquet" else _write_csv
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    total_rows = 0
+    try:
+        with session_for(user_id) as session, zipfile.ZipFile(spool, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, (model, columns) in EXPORT_TABLES.items():
+                chunks = iter_log_chunks(session, model, columns, user_id, chunk_size)
+                total_rows += write_table(zf, name, model, columns, chunks)
+    except Exception:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return spool, total_rows
+
+
+class SpooledInputFile(InputFile):
+    """
+    Отправляет в Telegram содержимое уже открытого файла кусками,
+    не читая его целиком в память. После отправки файл закрывается.
+    """
+
+    def __init__(self, file, filename: str, chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot):
+        try:
+            self.file.seek(0)
+            while chunk := self.file.read(self.chunk_size):
+                yield chunk
+        finally:
+            self.file.close()
@@ -2,24 +2,44 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.filters.state import StateFilter
 from aiogram.types import BufferedInputFile
-from db import SessionLocal
+from db import run_in_shard
+from export import EXPORT_FORMATS, SpooledInputFile, build_export, parquet_available
+from importer import IMPORT_FORMATS, import_file
+from sender import OutboundSender
+from reminders import ReminderScheduler
+from profiling import HandlerProfiler
+from recalc_goals import fetch_temperatures, recalculate_goals
+from config import ADMIN_IDS
+from trends import get_stats, record_log
+from compaction import daily_totals
+from analytics import build_report, build_snapshot, load_snapshot
 from models import User, WaterLog, FoodLog, WorkoutLog
 from utils import (
     get_current_temperature,
     get_food_calories,
     calculate_calorie_goal,
-    calculate_water_goal
+    calculate_water_goal,
+    calculate_workout,
+    MAX_WATER_AMOUNT,
+    MAX_FOOD_AMOUNT,
+    MAX_WORKOUT_DURATION
 )
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from charts import render_progress
 from aiogram import Router, types
 from aiogram.filters import Command
 from sqlalchemy import func
 from datetime import datetime
+import asyncio
+import html
+import math
+import os
+import tempfile
 
 
 router = Router()
 
+MAX_MESSAGE_LENGTH = 4096  # предел длины сообщения Telegram
+
 
 class ProfileStates(StatesGroup):
     waiting_for_weight = State()
@@ -35,6 +55,12 @@ class FoodStates(StatesGroup):
     waiting_for_food_amount = State()
 
 
+# Работа с базой выполняется через run_in_shard: в потоке шарда пользователя,
+# а не в event loop. Функции ниже получают сессию первым аргументом.
+def _load_user(session, user_id: int):
+    return session.query(User).filter(User.user_id == user_id).first()
+
+
 @router.message(Command("start"))
 async def cmd_start(message: types.Message):
     await message.answer(
@@ -57,7 +83,10 @@ async def cmd_help(message: types.Message):
         "/log_workout &lt;тип тренировки&gt; &lt;время (мин)&gt; - Записать тренировку\n"
         "/check_progress - Проверить прогресс по воде и калориям\n"
         "/plot_progress - Получить графики прогресса по воде и калориям\n"
-        "/recommendations - Получить персональные рекомендации по питанию и тренировкам"
+        "/recommendations - Получить персональные рекомендации по питанию и тренировкам\n"
+        "/reminders [on|off] - Включить или отключить напоминания о воде\n"
+        "/export [csv|parquet] - Выгрузить всю историю логов\n"
+        "/import - Загрузить историю логов из CSV/JSON (отправьте файл с этой командой в подписи)"
     )
     await message.answer(help_text)
 
@@ -142,8 +171,24 @@ async def process_sex(message: types.Message, state: FSMContext):
     await state.set_state(ProfileStates.waiting_for_calorie_goal)
 
 
+def _save_profile(session, user_id: int, data: dict, calorie_goal: float, calorie_goal_custom: bool):
+    user = _load_user(session, user_id)
+    if not user:
+        user = User(user_id=user_id)
+    user.weight = data.get("weight")
+    user.height = data.get("height")
+    user.age = data.get("age")
+    user.activity = data.get("activity")
+    user.city = data.get("city")
+    user.sex = data.get("sex")
+    user.calorie_goal = calorie_goal
+    user.calorie_goal_custom = calorie_goal_custom
+    session.add(user)
+    session.commit()
+
+
 @router.message(ProfileStates.waiting_for_calorie_goal)
-async def process_calorie_goal(message: types.Message, state: FSMContext):
+async def process_calorie_goal(message: types.Message, state: FSMContext, reminders: ReminderScheduler):
     data = await state.get_data()
     calorie_goal_input = message.text.strip().lower()
     if calorie_goal_input == "по умолчанию":
@@ -176,19 +221,10 @@ async def process_calorie_goal(message: types.Message, state: FSMContext):
     )
 
     user_id = message.from_user.id
-    with SessionLocal() as session:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            user = User(user_id=user_id)
-        user.weight = data.get("weight")
-        user.height = data.get("height")
-        user.age = data.get("age")
-        user.activity = data.get("activity")
-        user.city = data.get("city")
-        user.sex = data.get("sex")
-        user.calorie_goal = calorie_goal
-        session.add(user)
-        session.commit()
+    await run_in_shard(user_id, _save_profile, user_id, data, calorie_goal, calorie_goal_input != "по умолчанию")
+
+    # Напоминания включаются при настройке профиля; отключить — /reminders off
+    await reminders.schedule(user_id, water_goal)
 
     await message.answer(
         f"Ваш профиль успешно настроен!\n"
@@ -198,6 +234,25 @@ async def process_calorie_goal(message: types.Message, state: FSMContext):
     await state.clear()
 
 
+def _log_water(session, user_id: int, amount: float):
+    user = _load_user(session, user_id)
+    if not user:
+        return None, 0
+
+    record_log(session, user, water=amount)
+    water_log = WaterLog(user_id=user_id, amount=amount)
+    session.add(water_log)
+    session.commit()
+
+    # Рассчитываем общую выпитую воду за сегодня
+    start_of_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    total_water = session.query(func.sum(WaterLog.amount)).filter(
+        WaterLog.user_id == user_id,
+        WaterLog.timestamp >= start_of_day
+    ).scalar() or 0
+    return user, total_water
+
+
 @router.message(Command("log_water"))
 async def cmd_log_water(message: types.Message):
     text = message.text
@@ -211,47 +266,34 @@ async def cmd_log_water(message: types.Message):
     args = parts[1].strip()
     try:
         amount = float(args)
-        if amount <= 0 or amount > 10000:
+        if amount <= 0 or amount > MAX_WATER_AMOUNT:
             raise ValueError
     except ValueError:
         await message.answer("Пожалуйста, введите корректное числовое значение для количества воды в мл.")
         return
 
     user_id = message.from_user.id
-    with SessionLocal() as session:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
-            return
+    user, total_water = await run_in_shard(user_id, _log_water, user_id, amount)
+    if not user:
+        await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
+        return
 
-        water_log = WaterLog(user_id=user_id, amount=amount)
-        session.add(water_log)
-        session.commit()
-
-        # Рассчитываем общую выпитую воду за сегодня
-        from datetime import datetime
-        start_of_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        total_water = session.query(func.sum(WaterLog.amount)).filter(
-            WaterLog.user_id == user_id,
-            WaterLog.timestamp >= start_of_day
-        ).scalar() or 0
-
-        # Рассчитываем норму воды (заново, с учётом погоды)
-        temperature = await get_current_temperature(user.city)
-        water_goal = calculate_water_goal(
-            weight=user.weight,
-            activity_minutes=user.activity,
-            temperature=temperature
-        )
-        remaining = water_goal - total_water
-        if remaining < 0:
-            remaining = 0
+    # Рассчитываем норму воды (заново, с учётом погоды)
+    temperature = await get_current_temperature(user.city)
+    water_goal = calculate_water_goal(
+        weight=user.weight,
+        activity_minutes=user.activity,
+        temperature=temperature
+    )
+    remaining = water_goal - total_water
+    if remaining < 0:
+        remaining = 0
 
-        await message.answer(
-            f"Записано: {amount} мл.\n"
-            f"Всего сегодня выпито: {total_water:.0f} мл.\n"
-            f"Осталось до нормы: {remaining:.0f} мл."
-        )
+    await message.answer(
+        f"Записано: {amount} мл.\n"
+        f"Всего сегодня выпито: {total_water:.0f} мл.\n"
+        f"Осталось до нормы: {remaining:.0f} мл."
+    )
 
 
 @router.message(Command("log_food"))
@@ -277,11 +319,29 @@ async def cmd_log_food(message: types.Message, state: FSMContext):
     await state.set_state(FoodStates.waiting_for_food_amount)
 
 
+def _log_food(session, user_id: int, product_name: str, amount: float, calories: float) -> bool:
+    user = _load_user(session, user_id)
+    if not user:
+        return False
+
+    # Сохраняем лог в базе
+    record_log(session, user, calories_in=calories)
+    food_log = FoodLog(
+        user_id=user_id,
+        product_name=product_name,
+        amount=amount,
+        calories=calories
+    )
+    session.add(food_log)
+    session.commit()
+    return True
+
+
 @router.message(StateFilter(FoodStates.waiting_for_food_amount))
 async def process_food_amount(message: types.Message, state: FSMContext):
     try:
         amount = float(message.text)
-        if amount <= 0 or amount > 10000:
+        if amount <= 0 or amount > MAX_FOOD_AMOUNT:
             raise ValueError
     except ValueError:
         await message.answer("Пожалуйста, введите корректное числовое значение для количества в граммах.")
@@ -297,27 +357,35 @@ async def process_food_amount(message: types.Message, state: FSMContext):
     calories = (food_info['calories_per_100g'] * amount) / 100.0
 
     user_id = message.from_user.id
-    with SessionLocal() as session:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
-            await state.clear()
-            return
-
-        # Сохраняем лог в базе
-        food_log = FoodLog(
-            user_id=user_id,
-            product_name=food_info['name'],
-            amount=amount,
-            calories=calories
-        )
-        session.add(food_log)
-        session.commit()
+    if not await run_in_shard(user_id, _log_food, user_id, food_info['name'], amount, calories):
+        await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
+        await state.clear()
+        return
 
     await message.answer(f"Записано: {calories:.1f} ккал ({amount:.0f} г).")
     await state.clear()
 
 
+def _log_workout(session, user_id: int, workout_type: str, duration: int):
+    user = _load_user(session, user_id)
+    if not user:
+        return None
+
+    calories_burned, water_consumed = calculate_workout(workout_type, duration)
+
+    record_log(session, user, calories_out=calories_burned)
+    workout_log = WorkoutLog(
+        user_id=user_id,
+        workout_type=workout_type,
+        duration=duration,
+        calories_burned=calories_burned,
+        water_consumed=water_consumed
+    )
+    session.add(workout_log)
+    session.commit()
+    return calories_burned, water_consumed
+
+
 @router.message(Command("log_workout"))
 async def cmd_log_workout(message: types.Message):
     text = message.text
@@ -330,37 +398,18 @@ async def cmd_log_workout(message: types.Message):
     workout_type = parts[1].capitalize()
     try:
         duration = int(parts[2])
-        if duration <= 0 or duration > 1440:
+        if duration <= 0 or duration > MAX_WORKOUT_DURATION:
             raise ValueError
     except ValueError:
         await message.answer("Пожалуйста, введите корректное число (в минутах) для длительности тренировки.")
         return
 
     user_id = message.from_user.id
-    with SessionLocal() as session:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
-            return
-
-        calories_per_minute = {
-            'Бег': 10,
-            'Йога': 8,
-            'Плавание': 9,
-            'Велоспорт': 11
-        }
-        calories_burned = calories_per_minute.get(workout_type, 7) * duration
-        water_consumed = (duration // 30) * 200
-
-        workout_log = WorkoutLog(
-            user_id=user_id,
-            workout_type=workout_type,
-            duration=duration,
-            calories_burned=calories_burned,
-            water_consumed=water_consumed
-        )
-        session.add(workout_log)
-        session.commit()
+    logged = await run_in_shard(user_id, _log_workout, user_id, workout_type, duration)
+    if not logged:
+        await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
+        return
+    calories_burned, water_consumed = logged
 
     await message.answer(
         f"🏃‍♂️ {workout_type} {duration} мин — {calories_burned} ккал.\n"
@@ -368,211 +417,192 @@ async def cmd_log_workout(message: types.Message):
     )
 
 
+def _today_totals(session, user_id: int):
+    user = _load_user(session, user_id)
+    if not user:
+        return None, 0, 0, 0
+
+    start_of_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Сумма воды за сегодня
+    total_water = session.query(func.sum(WaterLog.amount)).filter(
+        WaterLog.user_id == user_id,
+        WaterLog.timestamp >= start_of_day
+    ).scalar() or 0
+
+    # Сумма полученных калорий
+    total_calories_consumed = session.query(func.sum(FoodLog.calories)).filter(
+        FoodLog.user_id == user_id,
+        FoodLog.timestamp >= start_of_day
+    ).scalar() or 0
+
+    # Сумма сожженных калорий
+    total_calories_burned = session.query(func.sum(WorkoutLog.calories_burned)).filter(
+        WorkoutLog.user_id == user_id,
+        WorkoutLog.timestamp >= start_of_day
+    ).scalar() or 0
+    return user, total_water, total_calories_consumed, total_calories_burned
+
+
 @router.message(Command("check_progress"))
 async def cmd_check_progress(message: types.Message):
     user_id = message.from_user.id
-    with SessionLocal() as session:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
-            return
+    user, total_water, total_calories_consumed, total_calories_burned = await run_in_shard(
+        user_id, _today_totals, user_id
+    )
+    if not user:
+        await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
+        return
 
-        # Рассчитываем норму воды с учётом погоды
-        temperature = await get_current_temperature(user.city)
-        water_goal = calculate_water_goal(
-            weight=user.weight,
-            activity_minutes=user.activity,
-            temperature=temperature
-        )
+    # Рассчитываем норму воды с учётом погоды
+    temperature = await get_current_temperature(user.city)
+    water_goal = calculate_water_goal(
+        weight=user.weight,
+        activity_minutes=user.activity,
+        temperature=temperature
+    )
 
-        from datetime import datetime
-        start_of_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-
-        # Сумма воды за сегодня
-        total_water = session.query(func.sum(WaterLog.amount)).filter(
-            WaterLog.user_id == user_id,
-            WaterLog.timestamp >= start_of_day
-        ).scalar() or 0
-
-        # Сумма полученных калорий
-        total_calories_consumed = session.query(func.sum(FoodLog.calories)).filter(
-            FoodLog.user_id == user_id,
-            FoodLog.timestamp >= start_of_day
-        ).scalar() or 0
-
-        # Сумма сожженных калорий
-        total_calories_burned = session.query(func.sum(WorkoutLog.calories_burned)).filter(
-            WorkoutLog.user_id == user_id,
-            WorkoutLog.timestamp >= start_of_day
-        ).scalar() or 0
-
-        # Баланс калорий (получено - сожжено)
-        calorie_balance = total_calories_consumed - total_calories_burned
-
-        remaining_water = water_goal - total_water
-        if remaining_water < 0:
-            remaining_water = 0
-
-        # Сколько калорий осталось до заданной цели
-        if user.calorie_goal:
-            remaining_calories = user.calorie_goal - calorie_balance
-            if remaining_calories < 0:
-                remaining_calories = 0
-        else:
-            remaining_calories = "—"
-
-        progress_text = (
-            "📊 Прогресс за сегодня:\n\n"
-            f"💧 Вода:\n"
-            f" • Выпито: {int(total_water)} мл из {int(water_goal)} мл\n"
-            f" • Осталось: {int(remaining_water)} мл\n\n"
-            f"🔥 Калории:\n"
-            f" • Потреблено: {total_calories_consumed:.1f} ккал\n"
-            f" • Сожжено: {total_calories_burned:.1f} ккал\n"
-            f" • Баланс: {calorie_balance:.1f} ккал\n"
-            f" • Целевая норма: {user.calorie_goal if user.calorie_goal else '—'} ккал\n"
-            f" • Осталось до цели: {remaining_calories if isinstance(remaining_calories, str) else f'{remaining_calories:.1f}'} ккал"
-        )
-        await message.answer(progress_text)
+    # Баланс калорий (получено - сожжено)
+    calorie_balance = total_calories_consumed - total_calories_burned
 
+    remaining_water = water_goal - total_water
+    if remaining_water < 0:
+        remaining_water = 0
 
-@router.message(Command("plot_progress"))
-async def cmd_progress_full(message: types.Message):
+    # Сколько калорий осталось до заданной цели
+    if user.calorie_goal:
+        remaining_calories = user.calorie_goal - calorie_balance
+        if remaining_calories < 0:
+            remaining_calories = 0
+    else:
+        remaining_calories = "—"
+
+    progress_text = (
+        "📊 Прогресс за сегодня:\n\n"
+        f"💧 Вода:\n"
+        f" • Выпито: {int(total_water)} мл из {int(water_goal)} мл\n"
+        f" • Осталось: {int(remaining_water)} мл\n\n"
+        f"🔥 Калории:\n"
+        f" • Потреблено: {total_calories_consumed:.1f} ккал\n"
+        f" • Сожжено: {total_calories_burned:.1f} ккал\n"
+        f" • Баланс: {calorie_balance:.1f} ккал\n"
+        f" • Целевая норма: {user.calorie_goal if user.calorie_goal else '—'} ккал\n"
+        f" • Осталось до цели: {remaining_calories if isinstance(remaining_calories, str) else f'{remaining_calories:.1f}'} ккал"
+    )
+    await message.answer(progress_text)
+
+
+@router.message(Command("reminders"))
+async def cmd_reminders(message: types.Message, reminders: ReminderScheduler):
+    parts = message.text.split(maxsplit=1)
+    mode = parts[1].strip().lower() if len(parts) > 1 else ""
     user_id = message.from_user.id
-    with SessionLocal() as session:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            await message.answer("Сначала настройте профиль через /set_profile.")
-            return
 
-        water_data = session.query(
-            func.strftime("%Y-%m-%d", WaterLog.timestamp).label("day"),
-            func.sum(WaterLog.amount)
-        ).filter(WaterLog.user_id == user_id).group_by("day").order_by("day").all()
+    if mode not in ("on", "off"):
+        status = "включены" if reminders.is_scheduled(user_id) else "выключены"
+        await message.answer(f"Напоминания о воде сейчас {status}. Используйте /reminders on или /reminders off.")
+        return
+
+    if mode == "off":
+        await reminders.unschedule(user_id)
+        await message.answer("Напоминания о воде отключены.")
+        return
 
-        food_data = session.query(
-            func.strftime("%Y-%m-%d", FoodLog.timestamp).label("day"),
-            func.sum(FoodLog.calories)
-        ).filter(FoodLog.user_id == user_id).group_by("day").order_by("day").all()
+    user = await run_in_shard(user_id, _load_user, user_id)
+    if not user:
+        await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
+        return
 
-        workout_data = session.query(
-            func.strftime("%Y-%m-%d", WorkoutLog.timestamp).label("day"),
-            func.sum(WorkoutLog.calories_burned)
-        ).filter(WorkoutLog.user_id == user_id).group_by("day").order_by("day").all()
+    temperature = await get_current_temperature(user.city)
+    water_goal = calculate_water_goal(
+        weight=user.weight,
+        activity_minutes=user.activity,
+        temperature=temperature
+    )
+    await reminders.schedule(user_id, water_goal)
+    await message.answer(f"Напоминания о воде включены. Норма на сегодня: {water_goal:.0f} мл.")
 
-    if not (water_data or food_data or workout_data):
-        await message.answer("Нет данных для построения графиков. Введите логи и попробуйте снова.")
+
+def _progress_data(session, user_id: int):
+    user = _load_user(session, user_id)
+    if not user:
+        return None, ({}, {}, {})
+    # Дневные суммы по логам и по уже сжатым старым дням
+    return user, daily_totals(session, user_id)
+
+
+@router.message(Command("plot_progress"))
+async def cmd_progress_full(message: types.Message, sender: OutboundSender):
+    user_id = message.from_user.id
+    user, (water_dict, food_dict, workout_dict) = await run_in_shard(user_id, _progress_data, user_id)
+    if not user:
+        await message.answer("Сначала настройте профиль через /set_profile.")
         return
 
-    water_dict = {day: total for day, total in water_data}
-    food_dict = {day: total for day, total in food_data}
-    workout_dict = {day: total for day, total in workout_data}
+    if not (water_dict or food_dict or workout_dict):
+        await message.answer("Нет данных для построения графиков. Введите логи и попробуйте снова.")
+        return
 
-    all_days = sorted(set(water_dict.keys()) | set(food_dict.keys()) | set(workout_dict.keys()))
+    days = sorted(set(water_dict.keys()) | set(food_dict.keys()) | set(workout_dict.keys()))
+    all_days = [day.isoformat() for day in days]
 
-    water_values = [water_dict.get(day, 0) for day in all_days]
-    net_calories = [food_dict.get(day, 0) - workout_dict.get(day, 0) for day in all_days]
+    water_values = [water_dict.get(day, 0) for day in days]
+    net_calories = [food_dict.get(day, 0) - workout_dict.get(day, 0) for day in days]
 
     temperature = await get_current_temperature(user.city)
     water_goal = calculate_water_goal(user.weight, user.activity, temperature)
     calorie_goal = user.calorie_goal if user.calorie_goal else 0
 
-    # График по воде (PNG)
-    water_fig = go.Figure()
-    water_fig.add_trace(go.Scatter(x=all_days, y=water_values,
-                                   mode="lines+markers", name="Выпито воды (мл)"))
-    water_fig.add_trace(go.Scatter(x=all_days, y=[water_goal] * len(all_days),
-                                   mode="lines", name="Норма воды (мл)",
-                                   line=dict(dash='dash')))
-    water_fig.update_layout(title="Прогресс по воде",
-                            xaxis_title="Дата",
-                            yaxis_title="Вода (мл)",
-                            template="plotly_white")
-
-    water_png = water_fig.to_image(format="png")
-
-    # График по калориям (PNG)
-    calorie_fig = go.Figure()
-    calorie_fig.add_trace(go.Scatter(x=all_days, y=net_calories,
-                                     mode="lines+markers", name="Баланс калорий (ккал)"))
-    calorie_fig.add_trace(go.Scatter(x=all_days, y=[calorie_goal] * len(all_days),
-                                     mode="lines", name="Целевая норма калорий (ккал)",
-                                     line=dict(dash='dash')))
-    calorie_fig.update_layout(title="Прогресс по калориям",
-                              xaxis_title="Дата",
-                              yaxis_title="Калории (ккал)",
-                              template="plotly_white")
-
-    calorie_png = calorie_fig.to_image(format="png")
-
-    # Интерактивный график (HTML)
-    # Объединённый график с двумя подграфиками
-    html_fig = make_subplots(rows=2, cols=1,
-                             subplot_titles=("Прогресс по воде", "Прогресс по калориям"),
-                             vertical_spacing=0.4)
-    html_fig.add_trace(
-        go.Scatter(x=all_days, y=water_values, mode="lines+markers", name="Выпито воды (мл)"),
-        row=1, col=1
+    # Два PNG и интерактивный HTML с двумя подграфиками. Рендер через kaleido
+    # (и первый импорт plotly) блокирует поток — выполняем его вне event loop
+    water_png, calorie_png, html_str = await asyncio.to_thread(
+        render_progress, all_days, water_values, net_calories, water_goal, calorie_goal
     )
-    html_fig.add_trace(
-        go.Scatter(x=all_days, y=[water_goal] * len(all_days), mode="lines", name="Норма воды (мл)",
-                   line=dict(dash='dash')),
-        row=1, col=1
-    )
-    html_fig.add_trace(
-        go.Scatter(x=all_days, y=net_calories, mode="lines+markers", name="Баланс калорий (ккал)"),
-        row=2, col=1
-    )
-    html_fig.add_trace(
-        go.Scatter(x=all_days, y=[calorie_goal] * len(all_days), mode="lines", name="Целевая норма калорий (ккал)",
-                   line=dict(dash='dash')),
-        row=2, col=1
-    )
-    html_fig.update_layout(title="Интерактивный график прогресса",
-                           template="plotly_white",
-                           height=700)
-    html_fig.update_xaxes(title_text="Дата", row=1, col=1)
-    html_fig.update_yaxes(title_text="Вода (мл)", row=1, col=1)
-    html_fig.update_xaxes(title_text="Дата", row=2, col=1)
-    html_fig.update_yaxes(title_text="Калории (ккал)", row=2, col=1)
-
-    html_str = html_fig.to_html(full_html=True)
     html_bytes = html_str.encode("utf-8")
 
     water_file = BufferedInputFile(water_png, filename="progress_water.png")
     calorie_file = BufferedInputFile(calorie_png, filename="progress_calories.png")
     html_file = BufferedInputFile(html_bytes, filename="progress_interactive.html")
 
-    await message.answer_photo(photo=water_file, caption="График прогресса по воде")
-    await message.answer_photo(photo=calorie_file, caption="График прогресса по калориям")
-    await message.answer_document(document=html_file, caption="Интерактивный график прогресса (откройте в браузере)")
+    # Оба PNG уходят одним альбомом; доставкой занимается очередь отправки
+    sender.send_photos(message.chat.id, [
+        (water_file, "График прогресса по воде"),
+        (calorie_file, "График прогресса по калориям"),
+    ])
+    sender.send_document(message.chat.id, document=html_file,
+                         caption="Интерактивный график прогресса (откройте в браузере)")
+
+
+def _load_stats(session, user_id: int):
+    user = _load_user(session, user_id)
+    if not user:
+        return None, None
+    # Суммы за сегодня и тренды хранятся в одной строке user_stats,
+    # поэтому история логов здесь не перечитывается
+    stats = get_stats(session, user)
+    session.commit()
+    return user, stats
 
 
 @router.message(Command("recommendations"))
 async def cmd_recommendations(message: types.Message):
     user_id = message.from_user.id
-    start_of_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-
-    with SessionLocal() as session:
-        user = session.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            await message.answer("Сначала настройте профиль с помощью /set_profile.")
-            return
-
-        total_food = session.query(func.sum(FoodLog.calories)).filter(
-            FoodLog.user_id == user_id,
-            FoodLog.timestamp >= start_of_day
-        ).scalar() or 0
 
-        total_workout = session.query(func.sum(WorkoutLog.calories_burned)).filter(
-            WorkoutLog.user_id == user_id,
-            WorkoutLog.timestamp >= start_of_day
-        ).scalar() or 0
+    user, stats = await run_in_shard(user_id, _load_stats, user_id)
+    if not user:
+        await message.answer("Сначала настройте профиль с помощью /set_profile.")
+        return
 
-        total_water = session.query(func.sum(WaterLog.amount)).filter(
-            WaterLog.user_id == user_id,
-            WaterLog.timestamp >= start_of_day
-        ).scalar() or 0
+    total_food = stats.today_calories_in
+    total_workout = stats.today_calories_out
+    total_water = stats.today_water
+    days_tracked = stats.days_tracked
+    balance_week = stats.balance_ewma7
+    balance_month = stats.balance_ewma30
+    balance_spread = math.sqrt(stats.balance_ewvar7)
+    water_week = stats.water_ewma7
+    water_streak = stats.water_streak
+    balance_streak = stats.balance_streak
 
     net_calories = total_food - total_workout
     calorie_goal = user.calorie_goal if user.calorie_goal else 0
@@ -625,10 +655,211 @@ async def cmd_recommendations(message: types.Message):
             "• <b>Вода:</b> Отлично, вы достигли или превысили норму потребления воды!"
         )
 
+    # Формируем рекомендации по трендам за неделю и месяц
+    if days_tracked >= 3:
+        trend_lines = [
+            f"• <b>Тренды:</b> средний баланс за неделю {balance_week:.0f} ккал (разброс ±{balance_spread:.0f}), "
+            f"за месяц {balance_month:.0f} ккал; воды в среднем {water_week:.0f} мл в день."
+        ]
+        if calorie_goal > 0 and balance_week > calorie_goal * 1.1:
+            trend_lines.append("  Баланс выше цели уже несколько дней подряд — стоит пересмотреть рацион в целом, "
+                               "а не только сегодняшний день.")
+        elif calorie_goal > 0 and balance_week < calorie_goal * 0.9:
+            trend_lines.append("  Баланс стабильно ниже цели — добавьте полноценный приём пищи в распорядок дня.")
+        if calorie_goal > 0 and balance_spread > calorie_goal * 0.25:
+            trend_lines.append("  Баланс сильно меняется день ото дня — постарайтесь питаться равномернее.")
+        if water_week < water_goal * 0.9:
+            trend_lines.append("  В среднем за неделю вы не добираете норму воды — включите /reminders on.")
+        if water_streak >= 3:
+            trend_lines.append(f"  Норма воды выполняется {water_streak} дн. подряд — так держать!")
+        if balance_streak >= 3:
+            trend_lines.append(f"  Баланс калорий в пределах цели {balance_streak} дн. подряд.")
+        trend_recommendation = "\n".join(trend_lines)
+    else:
+        trend_recommendation = "• <b>Тренды:</b> для анализа нужно хотя бы 3 дня записей."
+
     recommendation_text = (
         "🔍 <b>Рекомендации для вас на сегодня:</b>\n\n"
         f"{calorie_recommendation}\n\n"
-        f"{water_recommendation}"
+        f"{water_recommendation}\n\n"
+        f"{trend_recommendation}"
     )
 
     await message.answer(recommendation_text, parse_mode="HTML")
+
+
+@router.message(Command("export"))
+async def cmd_export(message: types.Message):
+    parts = message.text.split(maxsplit=1)
+    fmt = parts[1].strip().lower() if len(parts) > 1 else "csv"
+    if fmt not in EXPORT_FORMATS:
+        await message.answer("Пожалуйста, укажите формат csv или parquet. Пример: /export csv")
+        return
+    if fmt == "parquet" and not parquet_available():
+        await message.answer("Экспорт в Parquet сейчас недоступен, используйте /export csv.")
+        return
+
+    user_id = message.from_user.id
+    if not await run_in_shard(user_id, _load_user, user_id):
+        await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
+        return
+
+    # Выгрузка читает БД пачками и может идти долго — не блокируем event loop
+    export_file, total_rows = await asyncio.to_thread(build_export, user_id, fmt)
+    if total_rows == 0:
+        export_file.close()
+        await message.answer("Нет данных для экспорта. Введите логи и попробуйте снова.")
+        return
+
+    document = SpooledInputFile(export_file, filename=f"logs_{fmt}.zip")
+    await message.answer_document(document=document, caption=f"Экспорт логов: {total_rows} записей ({fmt})")
+
+
+@router.message(Command("import"))
+async def cmd_import(message: types.Message):
+    document = message.document
+    if not document:
+        await message.answer(
+            "Отправьте файл CSV, JSON, JSON Lines или zip-архив из /export с подписью /import.\n"
+            "Колонки: timestamp, amount (вода); timestamp, product_name, amount, calories (еда); "
+            "timestamp, workout_type, duration (тренировки). Вид лога задаётся колонкой type "
+            "(water/food/workout) или именем файла (water_logs.csv и т.п.)."
+        )
+        return
+
+    filename = document.file_name or "import.csv"
+    if os.path.splitext(filename)[1].lower() not in IMPORT_FORMATS:
+        await message.answer("Поддерживаются файлы .csv, .json, .jsonl и .zip.")
+        return
+
+    user_id = message.from_user.id
+    if not await run_in_shard(user_id, _load_user, user_id):
+        await message.answer("Пожалуйста, сначала настройте ваш профиль с помощью /set_profile.")
+        return
+
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as upload:
+        await message.bot.download(document, destination=upload)
+        upload.seek(0)
+        try:
+            # Разбор и вставка идут в отдельном потоке, чтобы не блокировать event loop
+            stats = await asyncio.to_thread(import_file, upload, filename, user_id)
+        except ValueError as e:
+            await message.answer(f"Не удалось разобрать файл: {e}\n"
+                                 "Записи, прочитанные до ошибки, могли быть уже сохранены.")
+            return
+
+    await message.answer(
+        "📥 Импорт завершён:\n"
+        f" • Вода: {stats['water']} записей\n"
+        f" • Еда: {stats['food']} записей\n"
+        f" • Тренировки: {stats['workout']} записей\n"
+        f" • Дневные суммы за старые дни: {stats['daily']}\n"
+        f" • Пропущено некорректных строк: {stats['skipped']}"
+    )
+
+
+@router.message(Command("profile"))
+async def cmd_profile(message: types.Message, profiler: HandlerProfiler):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    parts = message.text.split()
+    action = parts[1].lower() if len(parts) > 1 else "status"
+
+    if action == "on":
+        profiler.enabled = True
+    elif action == "off":
+        profiler.enabled = False
+    elif action == "rate":
+        try:
+            rate = float(parts[2])
+            if rate < 0 or rate > 1:
+                raise ValueError
+        except (IndexError, ValueError):
+            await message.answer("Укажите долю апдейтов от 0 до 1. Пример: /profile rate 0.01")
+            return
+        profiler.sample_rate = rate
+    elif action == "dump":
+        paths = await asyncio.to_thread(profiler.dump)
+        await message.answer("Сохранено:\n" + "\n".join(paths) if paths else "Пока нет данных профилирования.")
+        return
+    elif action == "reset":
+        profiler.reset()
+    elif action != "status":
+        await message.answer("Использование: /profile [status|on|off|rate &lt;доля&gt;|dump|reset]")
+        return
+
+    counts = ", ".join(f"{command}: {count}" for command, count in profiler.profiled_updates.most_common())
+    await message.answer(
+        f"Профилирование: {'включено' if profiler.enabled else 'выключено'}, доля {profiler.sample_rate:g}\n"
+        f"Профилировано апдейтов: {counts or 'нет'}"
+    )
+
+
+@router.message(Command("recalc_goals"))
+async def cmd_recalc_goals(message: types.Message, reminders: ReminderScheduler):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2 or parts[1].strip().lower() != "reload":
+        await message.answer("Пересчитываю нормы всех пользователей...")
+        temperatures = await fetch_temperatures()
+        stats = await asyncio.to_thread(recalculate_goals, temperatures)
+        await message.answer(
+            f"Готово. Пользователей: {stats['users']}, норм калорий: {stats['calorie_goals']}, "
+            f"норм воды: {stats['water_goals']}."
+        )
+
+    # Планировщик держит нормы воды в памяти — подтягиваем новые значения
+    reminders.goals.update(await asyncio.to_thread(reminders.load_goals))
+    await message.answer("Нормы воды в напоминаниях обновлены.")
+
+
+def _pre_messages(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list:
+    """Разбивает текст по строкам на сообщения <pre>…</pre> не длиннее limit символов."""
+    budget = limit - len("<pre></pre>")
+    messages, lines, size = [], [], 0
+    for line in text.split("\n"):
+        escaped = html.escape(line)
+        if len(escaped) > budget:
+            # Обрезаем до экранирования, чтобы не разрезать сущность вроде &amp;
+            escaped = html.escape(line[:budget // len("&quot;")])
+        line = escaped
+        if lines and size + 1 + len(line) > budget:
+            messages.append("\n".join(lines))
+            lines, size = [], 0
+        size += len(line) + (1 if lines else 0)
+        lines.append(line)
+    messages.append("\n".join(lines))
+    return [f"<pre>{message}</pre>" for message in messages]
+
+
+@router.message(Command("analytics"))
+async def cmd_analytics(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    parts = message.text.split()
+    argument = parts[1].lower() if len(parts) > 1 else ""
+    if argument == "refresh":
+        await message.answer("Строю новый снимок логов...")
+        await asyncio.to_thread(build_snapshot)
+        argument = parts[2] if len(parts) > 2 else ""
+
+    try:
+        days = int(argument) if argument else 30
+        if days <= 0 or days > 365:
+            raise ValueError
+    except ValueError:
+        await message.answer("Использование: /analytics [refresh] [дней от 1 до 365]")
+        return
+
+    # Отчёт считается только по снимку и вне event loop — рабочие таблицы не затрагиваются
+    snapshot = await asyncio.to_thread(load_snapshot)
+    if snapshot is None:
+        await message.answer("Снимок логов ещё не построен. Используйте /analytics refresh.")
+        return
+    report = await asyncio.to_thread(build_report, snapshot, days)
+    for part in _pre_messages(report):
+        await message.answer(part)
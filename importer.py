@@ -0,0 +1,257 @@
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sys
+import time
+import zipfile
+from datetime import date, datetime, timezone
+from db import engine_for, session_for
+from models import User, WaterLog, FoodLog, WorkoutLog, DailyLogTotal
+from compaction import TOTAL_COLUMNS, UPSERT_TOTALS_SQL
+from trends import rebuild_stats
+from utils import (
+    calculate_workout, MAX_WATER_AMOUNT, MAX_FOOD_AMOUNT, MAX_WORKOUT_DURATION,
+    MAX_FOOD_CALORIES, MAX_WORKOUT_CALORIES, MAX_WORKOUT_WATER
+)
+
+
+IMPORT_BATCH_SIZE = 10000  # строк в одном executemany
+IMPORT_FORMATS = (".csv", ".json", ".jsonl", ".ndjson", ".zip")
+
+# Имя таблицы/файла -> вид лога. Так же называются файлы в архиве /export.
+LOG_KINDS = {
+    "water": "water",
+    "water_logs": "water",
+    "food": "food",
+    "food_logs": "food",
+    "workout": "workout",
+    "workout_logs": "workout",
+    "daily_log_totals": "daily",
+}
+
+# Вид лога -> (таблица, колонки в порядке, в котором их возвращают парсеры)
+LOG_TABLES = {
+    "water": (WaterLog.__tablename__, ("user_id", "amount", "timestamp")),
+    "food": (FoodLog.__tablename__, ("user_id", "product_name", "amount", "calories", "timestamp")),
+    "workout": (WorkoutLog.__tablename__,
+                ("user_id", "workout_type", "duration", "calories_burned", "water_consumed", "timestamp")),
+    "daily": (DailyLogTotal.__tablename__, ("user_id", "day") + TOTAL_COLUMNS),
+}
+
+
+def _parse_timestamp(value) -> str:
+    if not value:
+        raise ValueError("нет даты")
+    timestamp = datetime.fromisoformat(str(value).strip())
+    if timestamp.tzinfo is not None:
+        # В базе время хранится в UTC без часового пояса
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    # Тот же формат, в котором SQLAlchemy хранит DateTime в SQLite
+    return timestamp.isoformat(" ", "microseconds")
+
+
+def _bounded(value, high: float, message: str, allow_zero: bool = False) -> float:
+    value = float(value)
+    # NaN и бесконечность проходят сравнения с границами, поэтому отсекаются отдельно
+    if not math.isfinite(value) or value < 0 or (value == 0 and not allow_zero) or value > high:
+        raise ValueError(message)
+    return value
+
+
+def _parse_water(row: dict, user_id: int) -> tuple:
+    amount = _bounded(row["amount"], MAX_WATER_AMOUNT, "количество воды вне допустимых границ")
+    return user_id, amount, _parse_timestamp(row.get("timestamp"))
+
+
+def _parse_food(row: dict, user_id: int) -> tuple:
+    product_name = (row.get("product_name") or "").strip()
+    if not product_name:
+        raise ValueError("нет названия продукта")
+    amount = _bounded(row["amount"], MAX_FOOD_AMOUNT, "количество еды вне допустимых границ")
+    calories = _bounded(row["calories"], MAX_FOOD_CALORIES, "калорийность вне допустимых границ", allow_zero=True)
+    return user_id, product_name.capitalize(), amount, calories, _parse_timestamp(row.get("timestamp"))
+
+
+def _parse_workout(row: dict, user_id: int) -> tuple:
+    workout_type = (row.get("workout_type") or "").strip().capitalize()
+    if not workout_type:
+        raise ValueError("нет типа тренировки")
+    duration = int(_bounded(row["duration"], MAX_WORKOUT_DURATION, "длительность тренировки вне допустимых границ"))
+    if duration <= 0:
+        raise ValueError("длительность тренировки вне допустимых границ")
+    # Если в файле нет расчётных полей — считаем их так же, как /log_workout
+    calories_burned, water_consumed = calculate_workout(workout_type, duration)
+    if row.get("calories_burned") not in (None, ""):
+        calories_burned = _bounded(row["calories_burned"], MAX_WORKOUT_CALORIES,
+                                   "сожжённые калории вне допустимых границ", allow_zero=True)
+    if row.get("water_consumed") not in (None, ""):
+        water_consumed = _bounded(row["water_consumed"], MAX_WORKOUT_WATER,
+                                  "расход воды вне допустимых границ", allow_zero=True)
+    return (user_id, workout_type, duration, calories_burned, water_consumed,
+            _parse_timestamp(row.get("timestamp")))
+
+
+def _parse_daily(row: dict, user_id: int) -> tuple:
+    # Дневные суммы уже сжатых дней из архива /export
+    day = date.fromisoformat(str(row.get("day") or "").strip())
+    totals = tuple(_bounded(row.get(column) or 0, math.inf, "дневная сумма вне допустимых границ", allow_zero=True)
+                   for column in TOTAL_COLUMNS)
+    return (user_id, day.isoformat()) + totals
+
+
+ROW_PARSERS = {
+    "water": _parse_water,
+    "food": _parse_food,
+    "workout": _parse_workout,
+    "daily": _parse_daily,
+}
+
+
+def _kind_from_filename(filename: str):
+    stem = os.path.splitext(os.path.basename(filename))[0].lower()
+    return LOG_KINDS.get(stem)
+
+
+def iter_raw_rows(fileobj, filename: str):
+    """
+    Потоково читает файл импорта и отдаёт пары (вид лога, строка-словарь).
+    Вид лога берётся из колонки "type", а если её нет — из имени файла
+    (water_logs.csv, food.jsonl и т.п.). Zip-архивы (например, из /export)
+    разбираются по вложенным файлам без распаковки на диск.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    default_kind = _kind_from_filename(filename)
+
+    if extension == ".zip":
+        with zipfile.ZipFile(fileobj) as zf:
+            for member in zf.infolist():
+                if member.is_dir():
+                    continue
+                with zf.open(member) as member_file:
+                    yield from iter_raw_rows(member_file, member.filename)
+        return
+
+    if extension == ".parquet":
+        raise ValueError(f"{filename}: импорт Parquet не поддерживается, используйте CSV или JSON")
+    if extension not in IMPORT_FORMATS:
+        raise ValueError(f"{filename}: неизвестный формат файла")
+
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        if extension == ".csv":
+            rows = csv.DictReader(text)
+        elif extension in (".jsonl", ".ndjson"):
+            rows = (json.loads(line) for line in text if line.strip())
+        else:
+            # Обычный JSON нельзя разобрать потоково без сторонних библиотек —
+            # для больших выгрузок лучше использовать JSON Lines
+            data = json.load(text)
+            rows = data.get("logs", []) if isinstance(data, dict) else data
+            if not isinstance(rows, list):
+                raise ValueError(f"{filename}: ожидается список записей или объект с ключом logs")
+
+        for row in rows:
+            if not isinstance(row, dict):
+                yield None, row
+                continue
+            kind = LOG_KINDS.get(str(row.get("type") or "").lower(), default_kind)
+            yield kind, row
+    finally:
+        text.detach()
+
+
+def import_rows(raw_rows, user_id: int, batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """
+    Проверяет строки теми же границами, что и обработчики команд,
+    и вставляет их пачками через executemany драйвера SQLite. Каждая
+    пачка — своя транзакция, поэтому при ошибке посреди файла строки
+    из уже записанных пачек остаются в базе. Некорректные строки
+    пропускаются. Возвращает число вставленных строк по видам логов
+    и число пропущенных строк.
+    """
+    stats = {"water": 0, "food": 0, "workout": 0, "daily": 0, "skipped": 0}
+    batches = {kind: [] for kind in LOG_TABLES}
+    # Пишем кортежи напрямую в драйвер: обработка параметров SQLAlchemy
+    # построчно занимает больше времени, чем сама вставка
+    insert_sql = {
+        kind: f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        for kind, (table, columns) in LOG_TABLES.items()
+    }
+    # Сжатый день мог уже быть в базе — суммы складываются
+    insert_sql["daily"] = UPSERT_TOTALS_SQL
+
+    with engine_for(user_id).connect() as conn:
+        def flush(kind):
+            conn.exec_driver_sql(insert_sql[kind], batches[kind])
+            # Блокировка записи шарда держится только на время вставки пачки,
+            # а не всего разбора файла — записи других пользователей не ждут
+            conn.commit()
+            stats[kind] += len(batches[kind])
+            batches[kind] = []
+
+        for kind, row in raw_rows:
+            parser = ROW_PARSERS.get(kind)
+            if parser is None:
+                stats["skipped"] += 1
+                continue
+            try:
+                batches[kind].append(parser(row, user_id))
+            except (KeyError, TypeError, ValueError):
+                stats["skipped"] += 1
+                continue
+            if len(batches[kind]) >= batch_size:
+                flush(kind)
+
+        for kind in LOG_TABLES:
+            if batches[kind]:
+                flush(kind)
+
+    return stats
+
+
+def import_file(fileobj, filename: str, user_id: int, batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    try:
+        return import_rows(iter_raw_rows(fileobj, filename), user_id, batch_size)
+    except (zipfile.BadZipFile, csv.Error) as e:
+        raise ValueError(f"{filename}: {e}") from e
+    finally:
+        # Производная статистика (тренды) пересчитывается один раз после вставки,
+        # в том числе после ошибки: пачки до неё уже сохранены
+        with session_for(user_id) as session:
+            user = session.get(User, user_id)
+            if user is not None:
+                rebuild_stats(session, user)
+                session.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Массовый импорт логов воды, еды и тренировок из CSV/JSON.")
+    parser.add_argument("--user-id", type=int, required=True, help="Telegram id пользователя")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("files", nargs="+", help="CSV, JSON, JSON Lines или zip-архив из /export")
+    args = parser.parse_args(argv)
+
+    with session_for(args.user_id) as session:
+        if not session.query(User).filter(User.user_id == args.user_id).first():
+            print(f"Пользователь {args.user_id} не найден. Сначала настройте профиль через /set_profile.")
+            return 1
+
+    for path in args.files:
+        started = time.perf_counter()
+        with open(path, "rb") as f:
+            stats = import_file(f, os.path.basename(path), args.user_id, args.batch_size)
+        elapsed = time.perf_counter() - started
+        imported = stats["water"] + stats["food"] + stats["workout"]
+        print(
+            f"{path}: вода {stats['water']}, еда {stats['food']}, тренировки {stats['workout']}, "
+            f"дневные суммы {stats['daily']}, "
+            f"пропущено {stats['skipped']} — {imported / max(elapsed, 1e-9):.0f} строк/с"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    """
+    Фоновая задача: раз в interval секунд выполняет run() в отдельном
+    потоке, не блокируя event loop. Ошибка одного прохода пишется в лог
+    и не останавливает бота и следующие проходы.
+    """
+
+    error_message = "Ошибка фоновой задачи"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.task = None
+
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def run(self):
+        raise NotImplementedError
+
+    async def start(self):
+        if self.enabled() and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run)
+            except Exception:
+                logger.exception(self.error_message)
+            await asyncio.sleep(self.interval)
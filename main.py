@@ -1,11 +1,76 @@
 # main.py
+import argparse
 import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
 from aiogram import Bot, Dispatcher
 from aiogram.client.bot import DefaultBotProperties
 from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
+from config import BOT_TOKEN, PRELOAD_PLOTTING
 from handlers import router
+from middlewares import ThrottlingMiddleware
+from sender import OutboundSender
+from reminders import ReminderScheduler
+from compaction import CompactionJob
+from analytics import AnalyticsJob
+from profiling import HandlerProfiler, ProfilingMiddleware
 from db import init_db
+from charts import preload_plotting
+
+
+logger = logging.getLogger(__name__)
+
+# Ссылки на фоновые задачи: event loop хранит только слабые ссылки,
+# и задачу без других ссылок может собрать сборщик мусора
+background_tasks = set()
+
+
+def _finish_background_task(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Ошибка фоновой задачи %s", task.get_name(), exc_info=task.exception())
+
+
+# Выполняется в отдельном интерпретаторе, чтобы замер был «холодным»
+STARTUP_PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+import_seconds = time.perf_counter() - started
+import_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy_modules = [name for name in ("plotly", "kaleido", "pyarrow", "numpy") if name in sys.modules]
+started = time.perf_counter()
+main.preload_plotting()
+plotting_seconds = time.perf_counter() - started
+plotting_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "import_seconds": import_seconds,
+    "import_rss_kb": import_rss_kb,
+    "heavy_modules": heavy_modules,
+    "plotting_seconds": plotting_seconds,
+    "plotting_rss_kb": plotting_rss_kb,
+}))
+"""
+
+
+def profile_startup():
+    """
+    Печатает время импорта бота и пиковый RSS процесса до и после
+    загрузки plotly и kaleido (которая теперь происходит при первом графике).
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_PROBE],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"Импорт бота: {report['import_seconds']:.2f} с, RSS {report['import_rss_kb'] / 1024:.0f} МБ")
+    print(f"Тяжёлые модули при старте: {', '.join(report['heavy_modules']) or 'нет'}")
+    print(f"Загрузка plotly и kaleido: +{report['plotting_seconds']:.2f} с, "
+          f"RSS {report['plotting_rss_kb'] / 1024:.0f} МБ")
 
 
 async def main():
@@ -14,11 +79,46 @@ async def main():
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
     dp = Dispatcher(storage=MemoryStorage())
 
+    sender = OutboundSender(bot)
+    reminders = ReminderScheduler(sender)
+    profiler = HandlerProfiler()
+    compaction = CompactionJob()
+    analytics = AnalyticsJob()
+    dp["sender"] = sender
+    dp["reminders"] = reminders
+    dp["profiler"] = profiler
+    dp.startup.register(profiler.start)
+    dp.startup.register(sender.start)
+    dp.startup.register(reminders.start)
+    dp.startup.register(compaction.start)
+    dp.startup.register(analytics.start)
+    # Сначала останавливаем планировщик, потом досылаем очередь
+    dp.shutdown.register(reminders.stop)
+    dp.shutdown.register(compaction.stop)
+    dp.shutdown.register(analytics.stop)
+    dp.shutdown.register(sender.stop)
+    dp.shutdown.register(profiler.stop)
+
+    dp.message.outer_middleware(ThrottlingMiddleware())
+    dp.message.outer_middleware(ProfilingMiddleware(profiler))
     dp.include_router(router)
 
+    if PRELOAD_PLOTTING:
+        # plotly прогревается в отдельном потоке, пока бот уже принимает сообщения
+        preload = asyncio.create_task(asyncio.to_thread(preload_plotting), name="preload_plotting")
+        background_tasks.add(preload)
+        preload.add_done_callback(_finish_background_task)
+
     print("Бот запущен!")
     await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Показать время старта и потребление памяти и выйти")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+from config import (
+    RATE_LIMIT_PER_MINUTE,
+    RATE_LIMIT_BURST,
+    EXPENSIVE_WORKERS,
+    EXPENSIVE_QUEUE_SIZE,
+    EXPENSIVE_MAX_WAIT,
+    CHEAP_LATENCY_SLO
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Стоимость команд в токенах; всё, что не указано, стоит DEFAULT_COMMAND_COST
+COMMAND_COSTS = {
+    "plot_progress": 5,
+    "export": 5,
+    "import": 5,
+    "log_food": 2,
+}
+DEFAULT_COMMAND_COST = 1
+
+# Команды, которые выполняются в отдельной ограниченной очереди
+EXPENSIVE_COMMANDS = {"plot_progress", "log_food", "export", "import"}
+
+MAX_TRACKED_USERS = 100_000  # сколько корзин держим в памяти
+
+
+def get_command(message: Message):
+    """
+    Возвращает имя команды без "/" и упоминания бота
+    (например, "plot_progress") или None, если это не команда.
+    """
+    text = message.text or message.caption
+    if not text or not text.startswith("/"):
+        return None
+    return text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+
+
+class TokenBucket:
+    """
+    Корзина токенов: пополняется со скоростью rate токенов в секунду
+    до capacity. Запрос проходит, если в корзине хватает токенов на его стоимость.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, cost: float = 1) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def time_until(self, cost: float = 1) -> float:
+        self._refill(time.monotonic())
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничивает частоту команд каждого пользователя корзиной токенов
+    и разводит команды по двум полосам: дешёвые выполняются сразу,
+    а тяжёлые (графики, поиск еды, экспорт/импорт) — не более чем в
+    EXPENSIVE_WORKERS параллельных обработчиках с ограниченной очередью.
+    При переполнении очереди тяжёлые запросы отклоняются, чтобы дешёвые
+    команды остальных пользователей отвечали вовремя.
+    """
+
+    def __init__(self,
+                 rate_per_minute: float = RATE_LIMIT_PER_MINUTE,
+                 burst: float = RATE_LIMIT_BURST,
+                 workers: int = EXPENSIVE_WORKERS,
+                 queue_size: int = EXPENSIVE_QUEUE_SIZE,
+                 max_wait: float = EXPENSIVE_MAX_WAIT,
+                 latency_slo: float = CHEAP_LATENCY_SLO):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_wait = max_wait
+        self.latency_slo = latency_slo
+        self.queue_size = queue_size
+        self.buckets = OrderedDict()  # user_id -> TokenBucket, в порядке последнего обращения
+        self.warned = set()  # кому уже ответили про лимит, чтобы не отвечать на каждый спам
+        self.workers = asyncio.Semaphore(workers)
+        self.waiting = 0
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self.buckets[user_id] = bucket
+            if len(self.buckets) > MAX_TRACKED_USERS:
+                # Самая давняя корзина к этому моменту давно заполнилась — её можно забыть
+                old_user_id, _ = self.buckets.popitem(last=False)
+                self.warned.discard(old_user_id)
+        else:
+            self.buckets.move_to_end(user_id)
+        return bucket
+
+    async def __call__(self, handler, event, data):
+        if not isinstance(event, Message) or event.from_user is None:
+            return await handler(event, data)
+
+        command = get_command(event)
+        user_id = event.from_user.id
+        cost = COMMAND_COSTS.get(command, DEFAULT_COMMAND_COST)
+        bucket = self._bucket(user_id)
+
+        if not bucket.consume(cost):
+            if user_id not in self.warned:
+                self.warned.add(user_id)
+                await event.answer(
+                    f"Слишком много запросов. Попробуйте снова через {bucket.time_until(cost):.0f} с."
+                )
+            return None
+        self.warned.discard(user_id)
+
+        if command in EXPENSIVE_COMMANDS:
+            return await self._run_expensive(handler, event, data, command)
+
+        started = time.monotonic()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.monotonic() - started
+            if elapsed > self.latency_slo:
+                logger.warning("Команда %s выполнялась %.2f с (SLO %.2f с)", command or "<text>", elapsed,
+                               self.latency_slo)
+
+    async def _run_expensive(self, handler, event: Message, data, command: str):
+        if self.workers.locked():
+            if self.waiting >= self.queue_size:
+                # Перегрузка: тяжёлую работу отбрасываем сразу, не занимая очередь
+                logger.warning("Очередь тяжёлых команд переполнена, /%s отклонена", command)
+                await event.answer("Сейчас бот перегружен. Пожалуйста, повторите команду через минуту.")
+                return None
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.workers.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                logger.warning("/%s ждала в очереди дольше %.0f с и отклонена", command, self.max_wait)
+                await event.answer("Сейчас бот перегружен. Пожалуйста, повторите команду через минуту.")
+                return None
+            finally:
+                self.waiting -= 1
+        else:
+            await self.workers.acquire()
+
+        try:
+            return await handler(event, data)
+        finally:
+            self.workers.release()
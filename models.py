@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Date, Index, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import datetime
@@ -18,6 +18,10 @@ class User(Base):
     activity = Column(Integer, nullable=True)
     city = Column(String, nullable=True)
     calorie_goal = Column(Float, nullable=True)
+    # Норма калорий введена вручную в /set_profile — пакетный пересчёт её не трогает.
+    # Для профилей, настроенных до появления флага, он заполняется при миграции
+    # (db._backfill_calorie_goal_custom); NULL считается нормой по умолчанию
+    calorie_goal_custom = Column(Boolean, nullable=True)
     sex = Column(String, nullable=True)  # Добавим пол пользователя
 
     logged_water = relationship("WaterLog", back_populates="user")
@@ -35,6 +39,11 @@ class WaterLog(Base):
 
     user = relationship("User", back_populates="logged_water")
 
+    __table_args__ = (
+        # Суммы воды за день по пользователям (напоминания, прогресс)
+        Index("ix_water_logs_user_id_timestamp", "user_id", "timestamp"),
+    )
+
 
 class FoodLog(Base):
     __tablename__ = "food_logs"
@@ -61,3 +70,43 @@ class WorkoutLog(Base):
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
 
     user = relationship("User", back_populates="logged_workouts")
+
+
+class ReminderSchedule(Base):
+    __tablename__ = "reminder_schedules"
+
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    water_goal = Column(Float)  # норма воды на момент настройки профиля, мл
+    next_due = Column(DateTime, index=True)  # когда в следующий раз проверить прогресс (UTC)
+    last_sent = Column(DateTime, nullable=True)
+
+
+class UserStats(Base):
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    day = Column(Date)  # день (UTC), за который копятся суммы today_*
+    today_water = Column(Float, default=0.0)  # мл
+    today_calories_in = Column(Float, default=0.0)
+    today_calories_out = Column(Float, default=0.0)
+    # Экспоненциальные скользящие средние по завершённым дням (~7 и ~30 дней)
+    water_ewma7 = Column(Float, default=0.0)
+    water_ewma30 = Column(Float, default=0.0)
+    balance_ewma7 = Column(Float, default=0.0)  # баланс калорий (получено - сожжено)
+    balance_ewma30 = Column(Float, default=0.0)
+    balance_ewvar7 = Column(Float, default=0.0)  # экспоненциальная дисперсия баланса
+    water_streak = Column(Integer, default=0)  # дней подряд с выполненной нормой воды
+    balance_streak = Column(Integer, default=0)  # дней подряд с балансом в пределах ±10% от цели
+    days_tracked = Column(Integer, default=0)
+
+
+class DailyLogTotal(Base):
+    __tablename__ = "daily_log_totals"
+
+    # Дневные суммы по логам старше горизонта хранения (см. compaction.py);
+    # сами строки логов за эти дни удаляются
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC
+    water = Column(Float, default=0.0)  # мл, сумма water_logs.amount
+    calories_in = Column(Float, default=0.0)  # сумма food_logs.calories
+    calories_out = Column(Float, default=0.0)  # сумма workout_logs.calories_burned
@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import os
+import random
+import re
+import sys
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+from config import PROFILING_ENABLED, PROFILING_SAMPLE_RATE, PROFILING_INTERVAL, PROFILING_DIR
+from middlewares import get_command
+
+
+# Профилируемый апдейт, к которому относится текущий контекст. Наследуется
+# задачами, созданными обработчиком, и передаётся в asyncio.to_thread
+_current_target = contextvars.ContextVar("profiling_target", default=None)
+
+AWAIT_MARKER = "[ожидание]"
+THREAD_MARKER = "[to_thread]"
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frames) -> str:
+    # Стек в формате flamegraph.pl / speedscope: от корня к листу через ";"
+    return ";".join(_frame_name(frame) for frame in frames)
+
+
+def _thread_frames(frame, stop=None) -> list:
+    """Кадры потока от корня к листу; если задан stop — начиная с этого кадра."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        if frame is stop:
+            break
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _coroutine_frames(coro) -> list:
+    """Цепочка кадров приостановленной (или выполняемой) корутины от внешней к внутренней."""
+    frames = []
+    while coro is not None:
+        frame = (getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+                 or getattr(coro, "ag_frame", None))
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = (getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+                or getattr(coro, "ag_await", None))
+    return frames
+
+
+class _Target:
+    """Профилируемый апдейт: его задача, команда и потоки to_thread, в которых идёт его работа."""
+
+    def __init__(self, task: asyncio.Task, command: str):
+        self.task = task
+        self.command = command
+        self.threads = set()
+
+
+class ProfilingExecutor(ThreadPoolExecutor):
+    """
+    Исполнитель по умолчанию для event loop: запоминает, какой поток выполняет
+    работу профилируемого апдейта (asyncio.to_thread, run_in_executor),
+    чтобы профилировщик снимал стек и этого потока.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        target = _current_target.get()
+        if target is None:
+            return super().submit(fn, *args, **kwargs)
+
+        def run(*args, **kwargs):
+            thread_id = threading.get_ident()
+            target.threads.add(thread_id)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                target.threads.discard(thread_id)
+
+        return super().submit(run, *args, **kwargs)
+
+
+class HandlerProfiler:
+    """
+    Выборочный профилировщик обработчиков. Для доли sample_rate апдейтов
+    фоновый поток раз в interval секунд снимает стек задачи обработчика:
+    если она выполняется — стек потока event loop до корутины задачи,
+    если ждёт — цепочку её корутин, а если ждёт asyncio.to_thread — ещё
+    и стек рабочего потока. Чужие обработчики в профиль не попадают.
+    Одновременно профилируется не больше одного апдейта, поэтому при
+    низкой доле накладные расходы почти нулевые. Результат сохраняется
+    в <dir>/<команда>.folded (формат collapsed stacks для flamegraph).
+    """
+
+    def __init__(self,
+                 enabled: bool = PROFILING_ENABLED,
+                 sample_rate: float = PROFILING_SAMPLE_RATE,
+                 interval: float = PROFILING_INTERVAL,
+                 directory: str = PROFILING_DIR):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.directory = directory
+        self.stacks = defaultdict(Counter)  # команда -> стек -> число снимков
+        self.profiled_updates = Counter()  # команда -> сколько апдейтов профилировано
+        self.lock = threading.Lock()
+        self.target = None  # _Target профилируемого сейчас апдейта
+        self.loop_thread_id = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    async def start(self):
+        # Работа обработчиков в to_thread идёт через исполнитель по умолчанию
+        asyncio.get_running_loop().set_default_executor(ProfilingExecutor())
+
+    def should_sample(self) -> bool:
+        return self.enabled and self.target is None and random.random() < self.sample_rate
+
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._sample_loop, name="handler-profiler", daemon=True)
+            self.thread.start()
+
+    def _task_stacks(self, target: _Target) -> list:
+        frames = sys._current_frames()
+        coroutine = _coroutine_frames(target.task.get_coro())
+        if not coroutine:
+            return []
+
+        # Задача выполняется, если её внешняя корутина есть в стеке потока event loop
+        loop_frames = _thread_frames(frames.get(self.loop_thread_id), stop=coroutine[0])
+        if loop_frames and loop_frames[0] is coroutine[0]:
+            return [_collapse(loop_frames)]
+
+        prefix = _collapse(coroutine)
+        stacks = []
+        for thread_id in list(target.threads):
+            frame = frames.get(thread_id)
+            if frame is not None:
+                stacks.append(f"{prefix};{THREAD_MARKER};{_collapse(_thread_frames(frame))}")
+        return stacks or [f"{prefix};{AWAIT_MARKER}"]
+
+    def _sample_loop(self):
+        while not self.stop_event.wait(self.interval):
+            target = self.target
+            if target is None:
+                continue
+            stacks = self._task_stacks(target)
+            with self.lock:
+                for stack in stacks:
+                    self.stacks[target.command][stack] += 1
+
+    def begin(self, command: str):
+        self._ensure_thread()
+        self.profiled_updates[command] += 1
+        self.loop_thread_id = threading.get_ident()
+        target = _Target(asyncio.current_task(), command)
+        self.target = target
+        return _current_target.set(target)
+
+    def end(self, token):
+        _current_target.reset(token)
+        self.target = None
+
+    def dump(self) -> list:
+        """Сохраняет накопленные стеки и возвращает список записанных файлов."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            snapshot = {command: Counter(stacks) for command, stacks in self.stacks.items()}
+        paths = []
+        for command, stacks in snapshot.items():
+            path = os.path.join(self.directory, f"{command}.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            paths.append(path)
+        return paths
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.profiled_updates.clear()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.stacks:
+            self.dump()
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    def __init__(self, profiler: HandlerProfiler):
+        self.profiler = profiler
+
+    async def __call__(self, handler, event, data):
+        if not self.profiler.should_sample():
+            return await handler(event, data)
+
+        command = (get_command(event) if isinstance(event, Message) else None) or "text"
+        if not re.fullmatch(r"[a-z0-9_]+", command):
+            command = "other"  # имя команды попадает в имя файла
+        token = self.profiler.begin(command)
+        try:
+            return await handler(event, data)
+        finally:
+            self.profiler.end(token)
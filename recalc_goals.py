@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import sys
+import time
+from sqlalchemy import select
+from db import fan_out
+from models import User, ReminderSchedule
+from utils import get_current_temperature, calculate_calorie_goal_batch, calculate_water_goal_batch
+
+
+RECALC_CHUNK_SIZE = 50000  # пользователей в одной пачке (и одной транзакции)
+WEATHER_CONCURRENCY = 10  # одновременных запросов к OpenWeatherMap
+
+
+def _iter_user_chunks(conn, chunk_size: int):
+    # Постраничное чтение по первичному ключу: курсор не держится открытым,
+    # пока в ту же базу пишутся обновления, и память не растёт с числом пользователей
+    last_user_id = None
+    while True:
+        stmt = (
+            select(User.user_id, User.weight, User.height, User.age, User.activity, User.sex, User.city,
+                   ReminderSchedule.user_id.isnot(None), User.calorie_goal_custom)
+            .outerjoin(ReminderSchedule, ReminderSchedule.user_id == User.user_id)
+            .where(User.weight.isnot(None), User.height.isnot(None),
+                   User.age.isnot(None), User.activity.isnot(None))
+            .order_by(User.user_id)
+            .limit(chunk_size)
+        )
+        if last_user_id is not None:
+            stmt = stmt.where(User.user_id > last_user_id)
+        rows = conn.execute(stmt).all()
+        if not rows:
+            return
+        yield rows
+        last_user_id = rows[-1][0]
+
+
+def _recalculate_shard(shard_engine, temperatures: dict, chunk_size: int,
+                       update_calories: bool, update_water: bool) -> dict:
+    import numpy as np
+
+    stats = {"users": 0, "calorie_goals": 0, "water_goals": 0}
+
+    # Одно соединение на чтение и запись: в SQLite открытая читающая транзакция
+    # в другом соединении не дала бы зафиксировать обновления
+    with shard_engine.connect() as conn:
+        for rows in _iter_user_chunks(conn, chunk_size):
+            user_ids, weight, height, age, activity, sex, city, has_schedule, custom = zip(*rows)
+            weight = np.array(weight, dtype=float)
+            activity = np.array(activity, dtype=float)
+
+            if update_calories:
+                calorie_goals = calculate_calorie_goal_batch(weight, height, age, activity,
+                                                             [s or '' for s in sex])
+                # Нормы, введённые вручную, не трогаем (флаг старых профилей
+                # заполняется при миграции в init_db)
+                recalculated = np.array([not value for value in custom], dtype=bool)
+                if recalculated.any():
+                    conn.exec_driver_sql(
+                        "UPDATE users SET calorie_goal = ?, calorie_goal_custom = 0 WHERE user_id = ?",
+                        list(zip(calorie_goals[recalculated].tolist(), np.array(user_ids)[recalculated].tolist()))
+                    )
+                    stats["calorie_goals"] += int(recalculated.sum())
+
+            if update_water:
+                scheduled = np.array(has_schedule, dtype=bool)
+                if scheduled.any():
+                    scheduled_cities = np.array(city, dtype=object)[scheduled]
+                    temperature = np.array(
+                        [temperatures.get((c or "").lower(), np.nan) for c in scheduled_cities], dtype=float
+                    )
+                    water_goals = calculate_water_goal_batch(weight[scheduled], activity[scheduled], temperature)
+                    scheduled_ids = np.array(user_ids)[scheduled].tolist()
+                    conn.exec_driver_sql(
+                        "UPDATE reminder_schedules SET water_goal = ? WHERE user_id = ?",
+                        list(zip(water_goals.tolist(), scheduled_ids))
+                    )
+                    stats["water_goals"] += len(scheduled_ids)
+
+            # Фиксируем каждую пачку, чтобы не держать блокировку записи долго
+            conn.commit()
+            stats["users"] += len(user_ids)
+
+    return stats
+
+
+def recalculate_goals(temperatures: dict = None, chunk_size: int = RECALC_CHUNK_SIZE,
+                      update_calories: bool = True, update_water: bool = True) -> dict:
+    """
+    Пересчитывает нормы всех пользователей с заполненным профилем:
+    calorie_goal в users и норму воды в reminder_schedules (у кого включены
+    напоминания). Пользователи читаются пачками, нормы считаются векторно
+    (NumPy), обновления пишутся пакетно через executemany; шарды
+    обрабатываются параллельно.
+    temperatures — {город в нижнем регистре: температура}; для остальных
+    городов надбавка за жару не начисляется.
+    Нормы калорий, введённые пользователем вручную, сохраняются.
+    """
+    stats = {"users": 0, "calorie_goals": 0, "water_goals": 0}
+    for shard_stats in fan_out(_recalculate_shard, temperatures or {}, chunk_size, update_calories, update_water):
+        for key, value in shard_stats.items():
+            stats[key] += value
+    return stats
+
+
+def _distinct_cities(shard_engine) -> list:
+    with shard_engine.connect() as conn:
+        return conn.execute(select(User.city).where(User.city.isnot(None)).distinct()).scalars().all()
+
+
+async def fetch_temperatures() -> dict:
+    """Запрашивает погоду один раз на каждый город пользователей, а не на каждого пользователя."""
+    # Запрос ко всем шардам блокирующий — выполняем его вне event loop
+    shard_cities = await asyncio.to_thread(fan_out, _distinct_cities)
+    cities = {(city or "").strip().lower() for rows in shard_cities for city in rows}
+    cities.discard("")
+
+    semaphore = asyncio.Semaphore(WEATHER_CONCURRENCY)
+
+    async def fetch(city):
+        async with semaphore:
+            return city, await get_current_temperature(city)
+
+    results = await asyncio.gather(*(fetch(city) for city in cities))
+    return {city: temperature for city, temperature in results if temperature is not None}
+
+
+def _parse_temperature(value: str):
+    city, _, temperature = value.rpartition("=")
+    if not city:
+        raise argparse.ArgumentTypeError("ожидается ГОРОД=ТЕМПЕРАТУРА")
+    return city.strip().lower(), float(temperature)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный пересчёт норм калорий и воды для всех пользователей.")
+    parser.add_argument("--chunk-size", type=int, default=RECALC_CHUNK_SIZE)
+    parser.add_argument("--fetch-weather", action="store_true",
+                        help="запросить текущую температуру для каждого города пользователей")
+    parser.add_argument("--temperature", type=_parse_temperature, action="append", default=[],
+                        metavar="ГОРОД=ТЕМП", help="задать температуру города вручную (можно несколько раз)")
+    parser.add_argument("--skip-calories", action="store_true", help="не пересчитывать нормы калорий")
+    parser.add_argument("--skip-water", action="store_true", help="не пересчитывать нормы воды")
+    args = parser.parse_args(argv)
+
+    temperatures = asyncio.run(fetch_temperatures()) if args.fetch_weather else {}
+    temperatures.update(args.temperature)
+
+    started = time.perf_counter()
+    stats = recalculate_goals(temperatures, args.chunk_size,
+                              update_calories=not args.skip_calories, update_water=not args.skip_water)
+    print(
+        f"Пользователей: {stats['users']}, норм калорий: {stats['calorie_goals']}, "
+        f"норм воды: {stats['water_goals']} — {time.perf_counter() - started:.1f} с"
+    )
+    print("Если бот запущен, обновите нормы в планировщике напоминаний командой /recalc_goals reload.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func, bindparam
+from db import run_in_shard, session_factories, group_by_shard, fan_out
+from models import ReminderSchedule, WaterLog
+from config import (
+    REMINDER_INTERVAL_MINUTES,
+    REMINDER_START_HOUR,
+    REMINDER_END_HOUR,
+    REMINDER_MIN_DEFICIT,
+    REMINDER_TICK_SECONDS
+)
+
+
+logger = logging.getLogger(__name__)
+
+REMINDER_BATCH_SIZE = 5000  # сколько напоминаний обрабатываем за один тик
+QUERY_CHUNK_SIZE = 500  # размер списка user_id в одном IN (...)
+
+# Обновление через Core, а не ORM bulk update по первичному ключу: ORM
+# проверяет число обновлённых строк и при отписке пользователя во время
+# тика (строка уже удалена) откатывает всю пачку шарда с StaleDataError.
+# Условие на прежний next_due не даёт затереть расписание, заново
+# сохранённое schedule(), пока пачка обрабатывалась
+_schedules = ReminderSchedule.__table__
+UPDATE_SCHEDULE = (
+    update(_schedules)
+    .where(_schedules.c.user_id == bindparam("uid"), _schedules.c.next_due == bindparam("old_due"))
+    .values(next_due=bindparam("due"), last_sent=func.coalesce(bindparam("sent"), _schedules.c.last_sent))
+)
+
+
+def _load_schedules(shard_engine) -> list:
+    with shard_engine.connect() as conn:
+        return conn.execute(
+            select(ReminderSchedule.user_id, ReminderSchedule.water_goal, ReminderSchedule.next_due)
+        ).all()
+
+
+def _save_schedule(session, user_id: int, water_goal: float, next_due: datetime):
+    session.merge(ReminderSchedule(user_id=user_id, water_goal=water_goal, next_due=next_due))
+    session.commit()
+
+
+def _delete_schedule(session, user_id: int):
+    session.execute(delete(ReminderSchedule).where(ReminderSchedule.user_id == user_id))
+    session.commit()
+
+
+class ReminderScheduler:
+    """
+    Планировщик напоминаний о воде. Время следующей проверки каждого
+    пользователя хранится в таблице reminder_schedules и в памяти в
+    куче (heapq), поэтому тик без наступивших напоминаний стоит O(1),
+    а с k наступившими — O(k log n) плюс один агрегирующий запрос на
+    пачку пользователей. Напоминания отправляются через OutboundSender.
+    """
+
+    def __init__(self, sender,
+                 interval_minutes: int = REMINDER_INTERVAL_MINUTES,
+                 start_hour: int = REMINDER_START_HOUR,
+                 end_hour: int = REMINDER_END_HOUR,
+                 min_deficit: float = REMINDER_MIN_DEFICIT,
+                 tick_seconds: float = REMINDER_TICK_SECONDS):
+        self.sender = sender
+        self.interval = timedelta(minutes=interval_minutes)
+        self.start_hour = start_hour
+        self.end_hour = end_hour
+        self.min_deficit = min_deficit
+        self.tick_seconds = tick_seconds
+        self.heap = []  # (next_due, user_id); устаревшие записи пропускаются при извлечении
+        self.due = {}  # user_id -> актуальный next_due
+        self.goals = {}  # user_id -> норма воды, мл
+        self.task = None
+
+    def load(self):
+        """Восстанавливает расписание из базы (всех шардов) после перезапуска."""
+        rows = [row for shard_rows in fan_out(_load_schedules) for row in shard_rows]
+        self.heap = [(next_due, user_id) for user_id, _, next_due in rows]
+        heapq.heapify(self.heap)
+        self.due = {user_id: next_due for user_id, _, next_due in rows}
+        self.goals = {user_id: water_goal for user_id, water_goal, _ in rows}
+
+    def load_goals(self) -> dict:
+        """Читает нормы воды из базы (например, после пакетного пересчёта норм)."""
+        return {user_id: water_goal
+                for shard_rows in fan_out(_load_schedules)
+                for user_id, water_goal, _ in shard_rows}
+
+    async def start(self):
+        await asyncio.to_thread(self.load)
+        logger.info("Загружено напоминаний: %d", len(self.due))
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def _push(self, user_id: int, next_due: datetime):
+        self.due[user_id] = next_due
+        heapq.heappush(self.heap, (next_due, user_id))
+
+    def next_slot(self, when: datetime) -> datetime:
+        """Сдвигает время напоминания в окно с start_hour до end_hour."""
+        day_start = when.replace(hour=self.start_hour, minute=0, second=0, microsecond=0)
+        if when < day_start:
+            return day_start
+        if when.hour >= self.end_hour:
+            return day_start + timedelta(days=1)
+        return when
+
+    async def schedule(self, user_id: int, water_goal: float, now: datetime = None):
+        """Включает (или обновляет) напоминания пользователя."""
+        now = now or datetime.utcnow()
+        next_due = self.next_slot(now + self.interval)
+        await run_in_shard(user_id, _save_schedule, user_id, water_goal, next_due)
+        self.goals[user_id] = water_goal
+        self._push(user_id, next_due)
+
+    async def unschedule(self, user_id: int):
+        await run_in_shard(user_id, _delete_schedule, user_id)
+        self.due.pop(user_id, None)
+        self.goals.pop(user_id, None)
+
+    def is_scheduled(self, user_id: int) -> bool:
+        return user_id in self.due
+
+    def _pop_due(self, now: datetime, limit: int = REMINDER_BATCH_SIZE) -> dict:
+        """Наступившие напоминания: {user_id: next_due, по которому они извлечены}."""
+        popped = {}
+        while self.heap and self.heap[0][0] <= now and len(popped) < limit:
+            next_due, user_id = heapq.heappop(self.heap)
+            if self.due.get(user_id) != next_due:
+                continue  # пользователь отписался или расписание уже сдвинуто
+            popped[user_id] = next_due
+        return popped
+
+    def _unchanged(self, popped: dict) -> list:
+        # Пользователи, чьё расписание не меняли (schedule/unschedule), пока шла пачка
+        return [user_id for user_id, due in popped.items() if self.due.get(user_id) == due]
+
+    def _expected_share(self, now: datetime) -> float:
+        # Какую долю дневной нормы к этому времени разумно уже выпить
+        window_start = now.replace(hour=self.start_hour, minute=0, second=0, microsecond=0)
+        window = timedelta(hours=self.end_hour - self.start_hour)
+        return min(max((now - window_start) / window, 0.0), 1.0)
+
+    def _process(self, popped: dict, now: datetime):
+        """
+        Считает выпитое за сегодня одним GROUP BY-запросом на пачку
+        пользователей (в каждом шарде), решает, кому напомнить, и пакетно
+        сохраняет новое время проверки. popped — результат _pop_due.
+        Выполняется в отдельном потоке.
+        """
+        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        expected_share = self._expected_share(now)
+        next_due = self.next_slot(now + self.interval)
+        reminders = []
+
+        for shard, shard_user_ids in group_by_shard(popped).items():
+            updates = []
+            with session_factories[shard]() as session:
+                totals = {}
+                for i in range(0, len(shard_user_ids), QUERY_CHUNK_SIZE):
+                    chunk = shard_user_ids[i:i + QUERY_CHUNK_SIZE]
+                    totals.update(session.execute(
+                        select(WaterLog.user_id, func.sum(WaterLog.amount))
+                        .where(WaterLog.user_id.in_(chunk), WaterLog.timestamp >= start_of_day)
+                        .group_by(WaterLog.user_id)
+                    ).all())
+
+                for user_id in shard_user_ids:
+                    goal = self.goals.get(user_id) or 0
+                    total = totals.get(user_id) or 0
+                    update_row = {"uid": user_id, "old_due": popped[user_id], "due": next_due, "sent": None}
+                    if goal and goal * expected_share - total >= self.min_deficit:
+                        reminders.append((user_id, total, goal))
+                        update_row["sent"] = now
+                    updates.append(update_row)
+
+                # Пакетное обновление (executemany); удалённые и заново сохранённые
+                # за это время строки просто не обновятся
+                session.execute(UPDATE_SCHEDULE, updates)
+                session.commit()
+
+        return reminders, next_due
+
+    async def tick(self, now: datetime = None) -> int:
+        now = now or datetime.utcnow()
+        popped = self._pop_due(now)
+        if not popped:
+            return 0
+
+        try:
+            reminders, next_due = await asyncio.to_thread(self._process, popped, now)
+        except Exception:
+            # Не теряем пользователей из кучи: попробуем снова на следующем интервале
+            next_due = self.next_slot(now + self.interval)
+            for user_id in self._unchanged(popped):
+                self._push(user_id, next_due)
+            raise
+
+        # Кто отписался или заново включил напоминания, пока шёл запрос,
+        # остаётся с новым расписанием, и напоминание из этой пачки ему не шлём
+        unchanged = set(self._unchanged(popped))
+        for user_id in unchanged:
+            self._push(user_id, next_due)
+
+        for user_id, total, goal in reminders:
+            if user_id not in unchanged:
+                continue
+            self.sender.send_message(
+                user_id,
+                f"💧 Напоминание: сегодня выпито {total:.0f} мл из {goal:.0f} мл.\n"
+                f"Выпейте стакан воды — до нормы осталось {goal - total:.0f} мл."
+            )
+        return len(popped)
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.tick()
+            except Exception:
+                logger.exception("Ошибка при обработке напоминаний")
+                processed = 0
+            # Если пачка заполнена целиком, сразу берём следующую
+            if processed < REMINDER_BATCH_SIZE:
+                await asyncio.sleep(self.tick_seconds)
@@ -0,0 +1,65 @@
+import argparse
+import sys
+import time
+from sqlalchemy import create_engine, inspect, select
+from db import engines, group_by_shard, init_db, shard_urls
+from models import Base
+
+
+RESHARD_BATCH_SIZE = 10000  # строк за одну выборку из исходной базы
+
+
+def reshard(source_url: str, batch_size: int = RESHARD_BATCH_SIZE) -> dict:
+    """
+    Переносит все данные из одной базы (например, прежней несшардированной)
+    в шарды из DATABASE_URL/DATABASE_SHARDS, раскладывая строки по user_id.
+    Шарды должны быть пустыми. Возвращает число перенесённых строк по таблицам.
+    """
+    source = create_engine(source_url, future=True)
+    source_tables = inspect(source).get_table_names()
+    init_db()
+
+    stats = {}
+    with source.connect() as src:
+        # sorted_tables — в порядке внешних ключей: users раньше логов
+        for table in Base.metadata.sorted_tables:
+            if table.name not in source_tables:
+                continue
+            # Колонки, добавленные позже, в старой базе может не быть
+            source_columns = {column["name"] for column in inspect(source).get_columns(table.name)}
+            columns = [column for column in table.columns if column.name in source_columns]
+            result = src.execute(select(*columns).execution_options(yield_per=batch_size))
+
+            stats[table.name] = 0
+            for partition in result.partitions():
+                rows = [dict(row._mapping) for row in partition]
+                by_user = {}
+                for row in rows:
+                    by_user.setdefault(row["user_id"], []).append(row)
+                for shard, user_ids in group_by_shard(by_user).items():
+                    with engines[shard].begin() as conn:
+                        conn.execute(table.insert(), [row for user_id in user_ids for row in by_user[user_id]])
+                stats[table.name] += len(rows)
+    source.dispose()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Перенос данных из одной базы в шарды по user_id.")
+    parser.add_argument("source_url", help="адрес исходной базы, например sqlite:///users.db")
+    parser.add_argument("--batch-size", type=int, default=RESHARD_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    if args.source_url in shard_urls():
+        print("Исходная база не должна быть одним из шардов.")
+        return 1
+
+    started = time.perf_counter()
+    stats = reshard(args.source_url, args.batch_size)
+    print(", ".join(f"{table}: {count}" for table, count in stats.items())
+          + f" — {len(engines)} шардов, {time.perf_counter() - started:.1f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
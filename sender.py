@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetUpdates
+from aiogram.types import InputMediaPhoto
+from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_WORKERS, SEND_QUEUE_SIZE
+from middlewares import TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+MAX_SEND_ATTEMPTS = 3
+MAX_TRACKED_CHATS = 100_000
+
+# Запросы, которые не расходуют общий лимит отправки (long polling)
+UNPACED_METHODS = (GetUpdates,)
+
+
+class GlobalRateMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: каждый запрос к Bot API — и из очереди
+    OutboundSender, и прямые ответы обработчиков (message.answer) —
+    ждёт токен общей корзины отправителя.
+    """
+
+    def __init__(self, sender: "OutboundSender"):
+        self.sender = sender
+
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, UNPACED_METHODS):
+            await self.sender.take_global()
+        return await make_request(bot, method)
+
+
+class OutboundSender:
+    """
+    Очередь исходящих сообщений. Обработчики ставят ответы в очередь и
+    не ждут доставки, а несколько фоновых задач отправляют их, соблюдая
+    общий лимит Telegram и лимит на один чат (корзины токенов).
+    Общий лимит соблюдается на уровне сессии бота (GlobalRateMiddleware),
+    поэтому в него входят и ответы, отправленные мимо очереди.
+    Сообщения в один чат уходят строго в порядке постановки в очередь.
+    При ответе 429 отправка в этот чат ждёт retry_after и повторяется.
+    """
+
+    def __init__(self, bot: Bot,
+                 global_rate: float = SEND_GLOBAL_RATE,
+                 chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST,
+                 workers: int = SEND_WORKERS,
+                 queue_size: int = SEND_QUEUE_SIZE):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers_count = workers
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.global_lock = asyncio.Lock()
+        self.chat_buckets = OrderedDict()  # chat_id -> TokenBucket
+        self.chat_locks = {}  # chat_id -> [asyncio.Lock, сколько сообщений в чат ещё не отправлено]
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = []
+        bot.session.middleware(GlobalRateMiddleware(self))
+
+    async def start(self):
+        for _ in range(self.workers_count):
+            self.workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        # Досылаем всё, что уже поставлено в очередь
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def _enqueue(self, chat_id: int, method: str, **kwargs):
+        try:
+            self.queue.put_nowait((chat_id, method, kwargs))
+        except asyncio.QueueFull:
+            logger.warning("Очередь отправки переполнена, сообщение в чат %s отброшено", chat_id)
+
+    def send_message(self, chat_id: int, text: str, **kwargs):
+        self._enqueue(chat_id, "send_message", text=text, **kwargs)
+
+    def send_photo(self, chat_id: int, photo, **kwargs):
+        self._enqueue(chat_id, "send_photo", photo=photo, **kwargs)
+
+    def send_document(self, chat_id: int, document, **kwargs):
+        self._enqueue(chat_id, "send_document", document=document, **kwargs)
+
+    def send_photos(self, chat_id: int, photos):
+        """
+        Отправляет несколько картинок одним альбомом (один запрос к API).
+        photos — список пар (файл, подпись).
+        """
+        media = [InputMediaPhoto(media=photo, caption=caption) for photo, caption in photos]
+        self._enqueue(chat_id, "send_media_group", media=media)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+            if len(self.chat_buckets) > MAX_TRACKED_CHATS:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    @staticmethod
+    async def _take(bucket: TokenBucket):
+        while not bucket.consume():
+            await asyncio.sleep(bucket.time_until())
+
+    async def take_global(self):
+        async with self.global_lock:
+            await self._take(self.global_bucket)
+
+    async def _worker(self):
+        while True:
+            chat_id, method, kwargs = await self.queue.get()
+            # Lock в asyncio справедливый, поэтому сообщения в один чат не переставляются
+            entry = self.chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    await self._send(chat_id, method, kwargs)
+            except Exception:
+                logger.exception("Не удалось отправить %s в чат %s", method, chat_id)
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.chat_locks[chat_id]
+                self.queue.task_done()
+
+    async def _send(self, chat_id: int, method: str, kwargs):
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            # Токен общей корзины берёт GlobalRateMiddleware при самом запросе
+            await self._take(self._chat_bucket(chat_id))
+            try:
+                return await getattr(self.bot, method)(chat_id=chat_id, **kwargs)
+            except TelegramRetryAfter as e:
+                if attempt == MAX_SEND_ATTEMPTS:
+                    raise
+                logger.warning("429 для чата %s, повтор через %s с", chat_id, e.retry_after)
+                await asyncio.sleep(e.retry_after)
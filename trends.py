@@ -0,0 +1,137 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy.orm import Session
+from compaction import daily_totals
+from models import User, UserStats
+from utils import calculate_water_goal
+
+
+# Сглаживание EWMA: alpha = 2 / (N + 1) для окна в N дней
+ALPHA_7 = 2 / (7 + 1)
+ALPHA_30 = 2 / (30 + 1)
+# Дальше этого числа пустых дней средние практически обнулены — дни не перебираем
+MAX_GAP_DAYS = 120
+
+# Значения по умолчанию колонок сработают только при INSERT, а считать нужно сразу
+EMPTY_STATS = {
+    "today_water": 0.0,
+    "today_calories_in": 0.0,
+    "today_calories_out": 0.0,
+    "water_ewma7": 0.0,
+    "water_ewma30": 0.0,
+    "balance_ewma7": 0.0,
+    "balance_ewma30": 0.0,
+    "balance_ewvar7": 0.0,
+    "water_streak": 0,
+    "balance_streak": 0,
+    "days_tracked": 0,
+}
+
+
+def _goals(user: User):
+    water_goal = calculate_water_goal(user.weight, user.activity) if user.weight is not None else 0
+    return water_goal, user.calorie_goal or 0
+
+
+def _fold_day(stats: UserStats, water: float, balance: float, water_goal: float, calorie_goal: float):
+    """Добавляет завершённый день в скользящие средние, дисперсию и серии."""
+    if not stats.days_tracked:
+        stats.water_ewma7 = stats.water_ewma30 = water
+        stats.balance_ewma7 = stats.balance_ewma30 = balance
+        stats.balance_ewvar7 = 0.0
+    else:
+        stats.water_ewma7 += ALPHA_7 * (water - stats.water_ewma7)
+        stats.water_ewma30 += ALPHA_30 * (water - stats.water_ewma30)
+        diff = balance - stats.balance_ewma7
+        increment = ALPHA_7 * diff
+        stats.balance_ewma7 += increment
+        stats.balance_ewvar7 = (1 - ALPHA_7) * (stats.balance_ewvar7 + diff * increment)
+        stats.balance_ewma30 += ALPHA_30 * (balance - stats.balance_ewma30)
+
+    stats.water_streak = stats.water_streak + 1 if water_goal and water >= water_goal else 0
+    in_range = calorie_goal and abs(balance - calorie_goal) <= calorie_goal * 0.1
+    stats.balance_streak = stats.balance_streak + 1 if in_range else 0
+    stats.days_tracked += 1
+
+
+def _roll_over(stats: UserStats, today: date, water_goal: float, calorie_goal: float):
+    """Закрывает дни от stats.day до today: их суммы уходят в средние, суммы дня обнуляются."""
+    if stats.day is None:
+        stats.day = today
+        return
+    if stats.day >= today:
+        return
+
+    _fold_day(stats, stats.today_water, stats.today_calories_in - stats.today_calories_out,
+              water_goal, calorie_goal)
+    empty_days = min((today - stats.day).days - 1, MAX_GAP_DAYS)
+    for _ in range(empty_days):
+        _fold_day(stats, 0.0, 0.0, water_goal, calorie_goal)
+
+    stats.day = today
+    stats.today_water = 0.0
+    stats.today_calories_in = 0.0
+    stats.today_calories_out = 0.0
+
+
+def _new_stats(session: Session, user: User, day: date) -> UserStats:
+    stats = UserStats(user_id=user.user_id, day=day, **EMPTY_STATS)
+    session.add(stats)
+    return stats
+
+
+def get_stats(session: Session, user: User, today: date = None) -> UserStats:
+    """
+    Возвращает статистику пользователя, актуальную на сегодня (O(1):
+    одна строка по первичному ключу). При первом обращении статистика
+    один раз строится по истории логов. Изменения фиксирует вызывающий код.
+    """
+    today = today or datetime.utcnow().date()
+    stats = session.get(UserStats, user.user_id)
+    if stats is None:
+        return rebuild_stats(session, user, today)
+    _roll_over(stats, today, *_goals(user))
+    return stats
+
+
+def record_log(session: Session, user: User, water: float = 0.0, calories_in: float = 0.0,
+               calories_out: float = 0.0):
+    """
+    Учитывает новую запись лога (за сегодня) в статистике пользователя.
+    Вызывается до добавления самой записи в сессию. Исторические записи
+    сюда не попадают — после импорта вызывается rebuild_stats.
+    """
+    stats = get_stats(session, user)
+    stats.today_water += water
+    stats.today_calories_in += calories_in
+    stats.today_calories_out += calories_out
+
+
+def rebuild_stats(session: Session, user: User, today: date = None) -> UserStats:
+    """
+    Пересчитывает статистику с нуля по дневным суммам всей истории.
+    Нужна после массового импорта, когда записи приходят не по порядку.
+    """
+    today = today or datetime.utcnow().date()
+    water, food, workouts = daily_totals(session, user.user_id)
+
+    stats = session.get(UserStats, user.user_id)
+    if stats is not None:
+        session.delete(stats)
+        session.flush()
+
+    days = sorted(set(water) | set(food) | set(workouts))
+    first_day = min(days[0], today) if days else today
+    stats = _new_stats(session, user, today)
+    water_goal, calorie_goal = _goals(user)
+
+    # Все дни от первой записи до вчера, включая дни без записей
+    day = first_day
+    while day < today:
+        _fold_day(stats, water.get(day, 0.0), food.get(day, 0.0) - workouts.get(day, 0.0),
+                  water_goal, calorie_goal)
+        day += timedelta(days=1)
+
+    stats.today_water = water.get(today, 0.0)
+    stats.today_calories_in = food.get(today, 0.0)
+    stats.today_calories_out = workouts.get(today, 0.0)
+    return stats
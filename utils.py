@@ -6,6 +6,24 @@ from sqlalchemy import func
 from datetime import datetime, timedelta
 
 
+# Допустимые границы вводимых значений (общие для обработчиков и импорта)
+MAX_WATER_AMOUNT = 10000  # мл за одну запись
+MAX_FOOD_AMOUNT = 10000  # граммов за одну запись
+MAX_WORKOUT_DURATION = 1440  # минут
+MAX_FOOD_CALORIES = 90000  # ккал за одну запись: MAX_FOOD_AMOUNT граммов чистого жира
+MAX_WORKOUT_CALORIES = 30000  # ккал за тренировку: ~20 ккал/мин всю MAX_WORKOUT_DURATION
+MAX_WORKOUT_WATER = MAX_WATER_AMOUNT  # мл за тренировку
+
+# Расход калорий в минуту по типам тренировок
+WORKOUT_CALORIES_PER_MINUTE = {
+    'Бег': 10,
+    'Йога': 8,
+    'Плавание': 9,
+    'Велоспорт': 11
+}
+DEFAULT_WORKOUT_CALORIES_PER_MINUTE = 7
+
+
 async def get_current_temperature(city: str) -> float:
     url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHERMAP_API_KEY}&units=metric"
     async with aiohttp.ClientSession() as session:
@@ -135,6 +153,52 @@ def calculate_water_goal(weight: float, activity_minutes: int, temperature: floa
     return water
 
 
+def calculate_calorie_goal_batch(weight, height, age, activity_minutes, sex):
+    """
+    Векторная версия calculate_calorie_goal для массивов NumPy
+    (или последовательностей) одинаковой длины. sex — массив строк.
+    """
+    import numpy as np
+
+    weight = np.asarray(weight, dtype=float)
+    height = np.asarray(height, dtype=float)
+    age = np.asarray(age, dtype=float)
+    activity_minutes = np.asarray(activity_minutes, dtype=float)
+    is_male = np.char.lower(np.asarray(sex, dtype=str)) == 'male'
+
+    bmr = 10 * weight + 6.25 * height - 5 * age + np.where(is_male, 5, -161)
+    activity_calories = (300 / 45) * activity_minutes
+    return bmr + activity_calories
+
+
+def calculate_water_goal_batch(weight, activity_minutes, temperature=None):
+    """
+    Векторная версия calculate_water_goal. temperature — массив температур
+    (NaN, если погода неизвестна) или None.
+    """
+    import numpy as np
+
+    weight = np.asarray(weight, dtype=float)
+    activity_minutes = np.asarray(activity_minutes, dtype=float)
+
+    water = weight * 30
+    water += (activity_minutes // 30) * 500
+    if temperature is not None:
+        water += np.where(np.asarray(temperature, dtype=float) > 25, 500, 0)
+    return water
+
+
+def calculate_workout(workout_type: str, duration: int) -> tuple:
+    """
+    Рассчитывает сожжённые калории и рекомендуемое дополнительное
+    потребление воды (200 мл за каждые 30 минут) для тренировки.
+    """
+    calories_per_minute = WORKOUT_CALORIES_PER_MINUTE.get(workout_type, DEFAULT_WORKOUT_CALORIES_PER_MINUTE)
+    calories_burned = calories_per_minute * duration
+    water_consumed = (duration // 30) * 200
+    return calories_burned, water_consumed
+
+
 def get_daily_water_stats(session: Session, user_id: int, days: int = 7):
     today = datetime.utcnow().date()
     start_date = today - timedelta(days=days-1)